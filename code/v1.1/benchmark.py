@@ -0,0 +1,564 @@
+# bot/benchmark.py
+
+import os
+import sys
+import random
+import time
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def timed(label, func, operations):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:8.3f}s  {operations / elapsed:10.1f} ops/s")
+    return elapsed
+
+class LegacyDatabaseManager:
+    """The pre-pool storage path: one connection and one commit per statement."""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+
+    def _execute_query(self, query, params=None):
+        with sqlite3.connect(self.db_file) as connection:
+            cursor = connection.cursor()
+            cursor.execute(query, params or ())
+            connection.commit()
+            return cursor
+
+    def store_user_data(self, user_id, data_id, response, lang):
+        table_name = f"user_{user_id}"
+        self._execute_query(f"CREATE TABLE IF NOT EXISTS {table_name} (data_id INTEGER PRIMARY KEY, response TEXT, lang TEXT)")
+        entry_count = self._execute_query(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+        if entry_count >= 20:
+            self._execute_query(f"DELETE FROM {table_name} WHERE data_id = (SELECT MIN(data_id) FROM {table_name})")
+        self._execute_query(f"INSERT INTO {table_name} (data_id, response, lang) VALUES (?, ?, ?)", (data_id, response, lang))
+
+    def retrieve_user_data_by_data_id(self, user_id, data_id):
+        return self._execute_query(f"SELECT response, lang FROM user_{user_id} WHERE data_id=?", (data_id,)).fetchone()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def run_storage_workload(manager, threads=8, users=50, replies=40):
+    response = "Sakura says hello. " * 40
+
+    def worker(offset):
+        for reply in range(replies):
+            user_id = offset * users + reply % users
+            data_id = offset * replies + reply + 1
+            manager.store_user_data(user_id, data_id, response, 'en')
+            manager.retrieve_user_data_by_data_id(user_id, data_id)
+
+    workers = [threading.Thread(target=worker, args=(offset,)) for offset in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return threads * replies
+
+def bench_database(threads=8, replies=40):
+    from datamanager import DatabaseManager
+
+    with tempfile.TemporaryDirectory() as directory:
+        engines = [
+            ("legacy (connect per statement)", lambda: LegacyDatabaseManager(os.path.join(directory, 'legacy.db'))),
+            ("pooled WAL synchronous=NORMAL", lambda: DatabaseManager(os.path.join(directory, 'normal.db'), synchronous='NORMAL')),
+            ("pooled WAL synchronous=FULL", lambda: DatabaseManager(os.path.join(directory, 'full.db'), synchronous='FULL')),
+            ("pooled WAL write-behind", lambda: DatabaseManager(os.path.join(directory, 'behind.db'), write_behind=True)),
+        ]
+        for label, factory in engines:
+            manager = factory()
+
+            def workload():
+                run_storage_workload(manager, threads=threads, replies=replies)
+                manager.flush()
+
+            timed(label, workload, threads * replies)
+            manager.close()
+
+def storage_engines(directory):
+    from datamanager import DatabaseManager, MemoryStorage, ShardedDatabaseManager
+
+    return [
+        ("memory", lambda: MemoryStorage()),
+        ("sqlite", lambda: DatabaseManager(os.path.join(directory, 'sqlite.db'))),
+        ("sqlite write-behind", lambda: DatabaseManager(os.path.join(directory, 'behind.db'), write_behind=True)),
+        ("sqlite sharded", lambda: ShardedDatabaseManager(os.path.join(directory, 'sharded.db'), shards=4)),
+    ]
+
+def bench_storage(threads=8, replies=40):
+    with tempfile.TemporaryDirectory() as directory:
+        for label, factory in storage_engines(directory):
+            storage = factory()
+
+            def workload():
+                run_storage_workload(storage, threads=threads, replies=replies)
+                storage.flush()
+
+            timed(label, workload, threads * replies)
+            storage.close()
+
+def slow_disk(manager, fsync_ms):
+    """Hold each transaction open for fsync_ms before it commits, as a disk with slow fsync would."""
+    transaction = manager.transaction
+
+    @contextmanager
+    def slow_transaction():
+        with transaction() as cursor:
+            yield cursor
+            # The write lock is held from the first write until the commit, so the wait is spent holding it.
+            time.sleep(fsync_ms / 1000)
+
+    manager.transaction = slow_transaction
+
+def shard_writer(db_file, shards, offset, replies, fsync_ms, start):
+    from datamanager import ShardedDatabaseManager
+
+    storage = ShardedDatabaseManager(db_file, shards=shards, synchronous='FULL', write_behind=False)
+    if fsync_ms:
+        for shard in storage.shards:
+            slow_disk(shard, fsync_ms)
+    response = "Sakura says hello. " * 40
+    start.wait()
+    for reply in range(replies):
+        storage.store_user_data(offset * 1000 + reply % 50, offset * replies + reply + 1, response, 'en')
+    storage.close()
+
+def bench_shards(processes=8, replies=100):
+    import multiprocessing
+    from datamanager import ShardedDatabaseManager
+
+    # Separate processes, like several bot instances on one host, so the only thing writers share is the SQLite write lock.
+    # Commits on a fast local disk are CPU-bound and sharding does not help them; the simulated 5ms fsync shows where it does.
+    with tempfile.TemporaryDirectory() as directory:
+        for fsync_ms in (0, 5):
+            disk = f"{fsync_ms}ms fsync" if fsync_ms else "local disk"
+            for shards in (1, 2, 4, 8):
+                db_file = os.path.join(directory, f'shards{shards}-{fsync_ms}.db')
+                ShardedDatabaseManager(db_file, shards=shards, write_behind=False).close()
+                start = multiprocessing.Event()
+                writers = [
+                    multiprocessing.Process(target=shard_writer, args=(db_file, shards, offset, replies, fsync_ms, start))
+                    for offset in range(processes)
+                ]
+                for writer in writers:
+                    writer.start()
+                time.sleep(1)
+
+                def workload():
+                    start.set()
+                    for writer in writers:
+                        writer.join()
+
+                timed(f"{disk}, {shards} shard(s), {processes} writers", workload, processes * replies)
+
+def load_helpers():
+    os.environ.setdefault('USER_ID', '*')
+    os.environ.setdefault('ADMIN_ID', '*')
+    os.environ.setdefault('TRANSLATION_CACHE_DB', '')
+    import global_helper
+    return global_helper
+
+def bench_translation_cache(lookups=20000):
+    helpers = load_helpers()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = helpers.TranslationCache(db_file=os.path.join(directory, 'translations.db'))
+        texts = [f"{response} #{index}" for index, response in enumerate(SAMPLE_RESPONSES * 20)]
+        for text in texts:
+            cache.put(text, 'en', 'id', (text.upper(), 'id'))
+        timed("memory tier hits", lambda: [cache.get(texts[i % len(texts)], 'en', 'id') for i in range(lookups)], lookups)
+        cache.memory.clear()
+        timed("disk tier hits", lambda: [cache.get(text, 'en', 'id') for text in texts], len(texts))
+        timed("misses", lambda: [cache.get(f"unseen {i}", 'en', 'id') for i in range(lookups)], lookups)
+        print(cache.stats())
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    body = b'[["hello world", "id"]]'
+    delay = 0.0
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(self.body)))
+            self.end_headers()
+            self.wfile.write(self.body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on this request, e.g. a translator deadline expired.
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(handler=StubHandler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/translate_a/t"
+
+def bench_http(calls=500):
+    helpers = load_helpers()
+    import requests
+
+    server, url = start_stub_server()
+    client = helpers.HttpClient()
+    for label, get in (("requests.get (new connection per call)", requests.get), ("shared HttpClient (keep-alive pool)", client.get)):
+        elapsed = timed(label, lambda: [get(url, params={'q': f"halo {i}"}).json() for i in range(calls)], calls)
+        print(f"{'':<40} {elapsed / calls * 1e3:8.3f}ms per call")
+    server.shutdown()
+
+class TailLatencyHandler(StubHandler):
+    """Answers in 10-30ms, except for 3% of requests that stall for two seconds."""
+
+    def do_GET(self):
+        self.delay = 2.0 if random.random() < 0.03 else random.uniform(0.01, 0.03)
+        StubHandler.do_GET(self)
+
+def bench_hedging(calls=300):
+    helpers = load_helpers()
+
+    server, url = start_stub_server(TailLatencyHandler)
+    for hedge in (False, True):
+        translator = helpers.Translator(cache=helpers.TranslationCache(db_file='', max_entries=0), detector=False)
+        translator.URL = url
+        translator.hedge = hedge
+        translator.deadline = 1.0
+        latencies = []
+        for i in range(calls):
+            start = time.perf_counter()
+            translator.translate_input(f"halo dunia {i}")
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        stats = translator.stats()
+        print(
+            f"hedging {'on ' if hedge else 'off'}  p50 {latencies[calls // 2] * 1e3:7.1f}ms  p99 {latencies[int(calls * 0.99)] * 1e3:7.1f}ms  "
+            f"hedged {stats['hedged']}  hedge wins {stats['hedge_wins']}  deadline fallbacks {stats['deadline_exceeded']}"
+        )
+    server.shutdown()
+
+LANGUAGE_SAMPLES = [
+    ("Can you recommend a good movie for tonight?", 'en'),
+    ("What are the symptoms of the flu?", 'en'),
+    ("Summarize the plot of Romeo and Juliet", 'en'),
+    ("how do i reset my router password", 'en'),
+    ("Write a haiku about autumn leaves", 'en'),
+    ("Is coffee bad for your health if you drink it every day?", 'en'),
+    ("Explain the theory of relativity in simple terms", 'en'),
+    ("I want to start a small business selling handmade candles", 'en'),
+    ("Bagaimana cara menanam cabai di dalam pot?", 'id'),
+    ("Tolong jelaskan sejarah kemerdekaan Indonesia", 'id'),
+    ("aku lagi bingung mau makan apa malam ini", 'id'),
+    ("Berapa lama perjalanan dari Bandung ke Surabaya?", 'id'),
+    ("¿Cuál es la receta tradicional de la paella?", 'es'),
+    ("Necesito ayuda con mi tarea de matemáticas", 'es'),
+    ("Quelle est la meilleure saison pour visiter Paris ?", 'fr'),
+    ("Je ne comprends pas cette phrase, peux-tu l'expliquer ?", 'fr'),
+    ("Wie kann ich mein Deutsch schnell verbessern?", 'de'),
+    ("Ich habe heute keine Lust zu arbeiten", 'de'),
+    ("Qual é a capital da Austrália?", 'pt'),
+    ("Come posso imparare a suonare la chitarra?", 'it'),
+    ("Wat is de beste manier om brood te bakken?", 'nl'),
+    ("東京でおすすめのラーメン屋はどこですか", 'ja'),
+    ("Как научиться программировать?", 'ru'),
+    # Latin-script languages without a bundled profile must not be mistaken for English.
+    ("Xin chào, bạn có thể giúp tôi viết một bài thơ không?", 'vi'),
+    ("Làm thế nào để học tiếng Anh nhanh hơn", 'vi'),
+    ("Nasılsın, bana yardım edebilir misin?", 'tr'),
+    ("Jak się masz, czy możesz mi pomóc?", 'pl'),
+    ("Hogyan tanulhatok gyorsabban angolul?", 'hu'),
+    ("Habari yako, unaweza kunisaidia?", 'sw'),
+    ("Mabuhay, paano ako makakatulong sa iyo ngayon?", 'tl'),
+    ("Hei, miten voin oppia englantia nopeammin?", 'fi'),
+    ("Ahoj, jak se máš? Můžeš mi pomoct?", 'cs'),
+    ("Salut, ce mai faci? Poți să mă ajuți?", 'ro'),
+    ("Hur mår du, kan du hjälpa mig?", 'sv'),
+]
+
+def bench_language_detection(repeat=200):
+    from language_detector import LanguageDetector
+
+    detector = LanguageDetector()
+    bypassed = [(text, lang) for text, lang in LANGUAGE_SAMPLES if detector.is_english(text)]
+    english = sum(1 for _, lang in LANGUAGE_SAMPLES if lang == 'en')
+    false_bypass = [text for text, lang in bypassed if lang != 'en']
+    detected = [(detector.detect(text)[0], lang) for text, lang in LANGUAGE_SAMPLES]
+    correct = sum(1 for found, lang in detected if found == lang or (found is None and lang not in detector.profiles))
+    print(f"threshold {detector.threshold}: {len(bypassed) - len(false_bypass)}/{english} English samples skip the translator, {len(false_bypass)} non-English samples wrongly skipped")
+    print(f"language identified correctly for {correct}/{len(LANGUAGE_SAMPLES)} samples")
+    timed("is_english()", lambda: [detector.is_english(text) for _ in range(repeat) for text, _ in LANGUAGE_SAMPLES], repeat * len(LANGUAGE_SAMPLES))
+
+def bench_semantic_cache(entries=100000, lookups=200):
+    from semantic_cache import SemanticCache
+
+    rng = random.Random(7)
+    subjects = ["capital", "history", "population", "weather", "food", "language", "currency", "music", "sport", "economy"]
+    places = [f"country{i}" for i in range(2000)]
+    templates = ["what is the {} of {}", "tell me about the {} of {}", "explain the {} in {}", "how is the {} in {} today"]
+    questions = [rng.choice(templates).format(rng.choice(subjects), rng.choice(places)) + f" {i}" for i in range(entries)]
+
+    cache = SemanticCache(capacity=entries, threshold=0.9, ttl=0)
+    timed(f"fill {entries} entries", lambda: [cache.add(question, i) for i, question in enumerate(questions)], entries)
+    probes = [questions[rng.randrange(entries)].upper() for _ in range(lookups)]
+    elapsed = timed(f"lookup at {entries} entries", lambda: [cache.lookup(probe) for probe in probes], lookups)
+    print(f"{'':<40} {elapsed / lookups * 1e3:8.3f}ms per lookup, {(cache.vectors.nbytes + cache.squares.nbytes) / 2 ** 20:.0f} MiB index")
+    print(cache.stats())
+
+def bench_llm_pool(calls=600, rate=400, threads=32):
+    from concurrent.futures import ThreadPoolExecutor
+    from llm_pool import BackendPool, FakeBackend, NoBackendAvailable, QUOTA_ERRORS
+
+    def run(pool):
+        def ask(i):
+            # Arrivals at a steady rate, like users sending messages.
+            time.sleep(max(0.0, start + i / rate - time.perf_counter()))
+            try:
+                return pool.chat({}, [f"q{i}"]) is not None
+            except QUOTA_ERRORS + (NoBackendAvailable,):
+                return False
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            answered = sum(executor.map(ask, range(calls)))
+        print(f"{'':<40} {answered}/{calls} answered in {time.perf_counter() - start:.2f}s")
+        print(f"{'':<40} {({name: (stats['requests'], stats['ejections']) for name, stats in pool.stats().items()})}")
+
+    # Every fake key allows 100 requests per 0.5s window (200/s); the third key has twice the weight.
+    def key(name, weight=1):
+        return FakeBackend(name, weight=weight, latency=0.02, quota=100, window=0.5)
+
+    print("1 key")
+    run(BackendPool([key('key-0')], cooldown=0.1))
+    for strategy in BackendPool.STRATEGIES:
+        print(f"3 keys, {strategy}")
+        run(BackendPool([key('key-0'), key('key-1'), key('key-2', weight=2)], strategy=strategy, cooldown=0.1))
+
+def bench_scheduler(heavy_requests=40, light_users=8, work=0.02):
+    from concurrent.futures import ThreadPoolExecutor
+    from scheduler import FairScheduler, RateLimited
+
+    # One user fires a burst of requests just before eight others send one message each.
+    arrivals = [('heavy', i * 0.001) for i in range(heavy_requests)]
+    arrivals += [(f"light-{i}", 0.05 + i * 0.001) for i in range(light_users)]
+
+    def run(label, slot):
+        waits = {}
+        rejected = []
+        start = time.perf_counter()
+
+        def request(arrival):
+            user_id, at = arrival
+            time.sleep(max(0.0, start + at - time.perf_counter()))
+            queued = time.perf_counter()
+            try:
+                with slot(user_id):
+                    waits.setdefault(user_id.split('-')[0], []).append(time.perf_counter() - queued)
+                    time.sleep(work)
+            except RateLimited:
+                rejected.append(user_id)
+
+        with ThreadPoolExecutor(len(arrivals)) as executor:
+            list(executor.map(request, arrivals))
+        light = waits.get('light', [0])
+        print(
+            f"{label:<40} light users wait {sum(light) / len(light) * 1e3:6.1f}ms on average, {max(light) * 1e3:6.1f}ms worst; "
+            f"{len(waits.get('heavy', []))} heavy requests served, {len(rejected)} rejected"
+        )
+
+    fifo = threading.Semaphore(4)
+
+    class FifoSlot:
+        def __init__(self, user_id):
+            pass
+
+        def __enter__(self):
+            fifo.acquire()
+
+        def __exit__(self, *exc):
+            fifo.release()
+
+    run("shared semaphore, 4 slots", FifoSlot)
+    scheduler = FairScheduler(max_concurrent=4, rate=60, burst=5, max_queued=64, max_queued_per_user=1, wait_timeout=5)
+    run("fair scheduler, 4 slots", scheduler.slot)
+    print(scheduler.stats())
+
+def speech_like_pcm(seconds, rate=24000):
+    import numpy as np
+
+    # A voiced tone with a slowly gliding pitch and syllable-rate loudness changes, close enough to speech for timing.
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    wave = (0.5 * np.sin(phase) + 0.3 * np.sin(2 * phase) + 0.2 * np.sin(3 * phase)) * (0.55 + 0.45 * np.sin(2 * np.pi * 3.3 * t))
+    return (wave * 0.6 * 32767).astype('<i2')
+
+def speech_like_mp3(global_helper, seconds, rate=24000):
+    pcm = speech_like_pcm(seconds, rate).tobytes()
+    return global_helper.ffmpeg_pipe(pcm, ['-f', 's16le', '-ac', '1', '-ar', str(rate)], ['-f', 'mp3', '-b:a', '32k'])
+
+def mean_spectrum(samples, size=1024):
+    import numpy as np
+
+    frames = np.lib.stride_tricks.sliding_window_view(samples.astype(np.float32), size)[::size // 4]
+    return np.abs(np.fft.rfft(frames * np.hanning(size), axis=1)).mean(axis=0)
+
+def spectral_distance(reference, candidate):
+    """Log-spectral distance in dB between the long-term spectra of two clips; pitch or timbre damage shows up here."""
+    import numpy as np
+
+    ratio = (mean_spectrum(candidate) + 1e-3) / (mean_spectrum(reference) + 1e-3)
+    return float(np.sqrt(np.mean((20 * np.log10(ratio)) ** 2)))
+
+def bench_timestretch(lengths=(5, 20, 60), speed=1.22, rate=24000):
+    import numpy as np
+    from pydub import AudioSegment
+    from timestretch import time_stretch
+
+    for seconds in lengths:
+        original = speech_like_pcm(seconds, rate)
+        start = time.process_time()
+        segment = AudioSegment(data=original.tobytes(), sample_width=2, frame_rate=rate, channels=1).speedup(playback_speed=speed)
+        pydub_cpu = time.process_time() - start
+        reference = np.frombuffer(segment.raw_data, dtype='<i2')
+        start = time.process_time()
+        stretched = time_stretch(original, speed, rate)
+        numpy_cpu = time.process_time() - start
+        print(f"{seconds}s of audio at {speed}x")
+        for label, output, cpu in (("pydub speedup", reference, pydub_cpu), ("numpy WSOLA", stretched, numpy_cpu)):
+            print(
+                f"  {label:<38} {seconds / cpu:8.1f} audio-s per CPU-s, {len(output) / rate:6.2f}s long "
+                f"(target {seconds / speed:.2f}s), {spectral_distance(original, output):5.2f} dB from the original spectrum"
+            )
+        print(f"  {'WSOLA vs pydub output':<38} {spectral_distance(reference, stretched):5.2f} dB apart, durations differ by {abs(len(stretched) - len(reference)) / rate * 1e3:.0f}ms")
+
+def bench_tts(characters=1200, request_seconds=0.25):
+    global_helper = load_helpers()
+    clips = {}
+
+    def synthesize(text, user_lang):
+        # gTTS sends one request per 100 characters, one after the other; speech runs at about 15 characters a second.
+        time.sleep(request_seconds * -(-len(text) // 100))
+        seconds = max(1, round(len(text) / 15))
+        if seconds not in clips:
+            clips[seconds] = speech_like_mp3(global_helper, seconds)
+        return clips[seconds]
+
+    text = ' '.join(SAMPLE_RESPONSES * 8)[:characters]
+    # Encode every clip length up front so only synthesis and processing are timed.
+    for seconds in range(1, characters // 15 + 2):
+        clips[seconds] = speech_like_mp3(global_helper, seconds)
+
+    def run(label, segment_chars, stream_first=False):
+        audio = global_helper.Audio()
+        audio.synthesize = synthesize
+        audio.segment_chars = segment_chars
+        audio.stream_first = stream_first
+        start = time.perf_counter()
+        first = None
+        for _, voice in audio.tts_parts((text, 'en')):
+            first = first or time.perf_counter() - start
+        total = time.perf_counter() - start
+        print(f"{label:<40} first audio after {first:6.2f}s, all audio after {total:6.2f}s")
+
+    print(f"{len(text)} characters, {request_seconds}s per simulated gTTS request")
+    run("one gTTS call", segment_chars=len(text))
+    run(f"sentence groups, {global_helper.audio.executor._max_workers} workers", segment_chars=200)
+    run("sentence groups, first part streamed", segment_chars=200, stream_first=True)
+
+def bench_voice_encoding(lengths=(5, 30), repeat=3, downlink_kbps=1000):
+    global_helper = load_helpers()
+    audio = global_helper.Audio()
+    encodings = [
+        ("mp3, 128k (previous default)", 'mp3', '128k', None),
+        ("ogg/opus, 32k, complexity 10", 'ogg', '32k', 10),
+        ("ogg/opus, 32k, complexity 5", 'ogg', '32k', 5),
+        ("ogg/opus, 24k, complexity 5", 'ogg', '24k', 5),
+        ("ogg/opus, 32k, complexity 0", 'ogg', '32k', 0),
+    ]
+    for seconds in lengths:
+        pcm = speech_like_pcm(seconds, audio.sample_rate).tobytes()
+        print(f"{seconds}s voice reply, download times at {downlink_kbps} kbit/s")
+        for label, audio_format, bitrate, complexity in encodings:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                encoded = audio.encode(pcm, audio_format, bitrate, complexity)
+            elapsed = (time.perf_counter() - start) / repeat
+            print(f"  {label:<38} encode {elapsed * 1e3:7.1f}ms  {len(encoded):8d} bytes  download {len(encoded) * 8 / downlink_kbps:7.1f}ms")
+
+SAMPLE_RESPONSES = [
+    "Sure, here is a summary of the text: The mitochondria is the powerhouse of the cell. It produces energy in the form of ATP through cellular respiration, which is why cells with high energy demands contain many of them.",
+    "Here are some of the most common examples:\n\n1. **Cherry blossoms** bloom in early spring.\n2. **Plum blossoms** appear slightly earlier.\n3. **Peach blossoms** follow shortly after.\n\nIt is important to note that this is not an exhaustive list.",
+    "I'm sorry, but an unexpected problem has occurred. If you wish, you can try again later.",
+    "Python is a high-level, general-purpose programming language. Its design philosophy emphasizes code readability with the use of significant indentation.\n\nRead more: [Wikipedia](https://en.wikipedia.org/wiki/Python_(programming_language))",
+    "There are many different ways to learn a new language, depending on the time you have available. However, the most important thing is to practice every day, for example by reading, listening to podcasts, and speaking with native speakers. I hope this helps! Let me know if you have any other questions.",
+]
+
+def load_responses(db_file):
+    from datamanager import DatabaseManager
+
+    if not db_file or not os.path.exists(db_file):
+        return SAMPLE_RESPONSES * 40
+    db_manager = DatabaseManager(db_file)
+    cursor = db_manager._execute_query("SELECT response FROM responses LIMIT 2000")
+    responses = [db_manager.codec.decode(response) for (response,) in cursor.fetchall()]
+    db_manager.close()
+    return [response for response in responses if response] or SAMPLE_RESPONSES * 40
+
+def bench_compression(db_file='user_data.db'):
+    from datamanager import ResponseCodec, train_dictionary
+
+    responses = load_responses(db_file)
+    raw_bytes = sum(len(response.encode('utf-8')) for response in responses)
+    codecs = [
+        ("zlib, no dictionary", ResponseCodec(enabled=True, dictionary=b' ')),
+        ("zlib, bundled dictionary", ResponseCodec(enabled=True)),
+        ("zlib, trained dictionary", ResponseCodec(enabled=True, dictionary=train_dictionary(responses))),
+    ]
+    print(f"{len(responses)} responses, {raw_bytes} bytes uncompressed")
+    for label, codec in codecs:
+        start = time.perf_counter()
+        encoded = [codec.encode(response) for response in responses]
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for value in encoded:
+            codec.decode(value)
+        decode_time = time.perf_counter() - start
+        stored_bytes = sum(len(value) if isinstance(value, bytes) else len(value.encode('utf-8')) for value in encoded)
+        print(
+            f"{label:<40} {stored_bytes / raw_bytes:6.1%} of original  "
+            f"encode {encode_time / len(responses) * 1e6:7.1f}us  decode {decode_time / len(responses) * 1e6:7.1f}us"
+        )
+
+BENCHMARKS = {
+    'database': bench_database,
+    'compression': bench_compression,
+    'storage': bench_storage,
+    'shards': bench_shards,
+    'translation_cache': bench_translation_cache,
+    'http': bench_http,
+    'language_detection': bench_language_detection,
+    'hedging': bench_hedging,
+    'semantic_cache': bench_semantic_cache,
+    'llm_pool': bench_llm_pool,
+    'scheduler': bench_scheduler,
+    'tts': bench_tts,
+    'timestretch': bench_timestretch,
+    'voice_encoding': bench_voice_encoding,
+}
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
@@ -0,0 +1,96 @@
+# bot/conversation.py
+
+import os
+import json
+import time
+import logging
+import threading
+from cache import LRUCache
+from datamanager import ConnectionPool
+
+def history_size(turns):
+    return sum(len(text.encode('utf-8')) for turn in turns for text in turn)
+
+class ConversationMemory:
+    """Each user's most recent chat turns, capped per user and in total, optionally kept in SQLite."""
+
+    def __init__(self, db_file=None, max_user_bytes=None, max_turns=None, max_bytes=None, max_users=None, ttl=None):
+        self.max_user_bytes = int(max_user_bytes if max_user_bytes is not None else os.getenv('CHAT_HISTORY_BYTES', 4000))
+        self.max_turns = int(max_turns if max_turns is not None else os.getenv('CHAT_HISTORY_TURNS', 10))
+        self.ttl = float(ttl if ttl is not None else os.getenv('CHAT_HISTORY_TTL', 6 * 3600))
+        # Every append re-inserts the user, so the LRU order and the TTL both follow the user's last message.
+        self.memory = LRUCache(
+            max_entries=max_users if max_users is not None else os.getenv('CHAT_MEMORY_USERS', 10000),
+            max_bytes=max_bytes if max_bytes is not None else os.getenv('CHAT_MEMORY_BYTES', 32 * 1024 * 1024),
+            ttl=self.ttl,
+            sizeof=history_size,
+        )
+        db_file = db_file if db_file is not None else os.getenv('CHAT_HISTORY_DB', '')
+        self.pool = ConnectionPool(db_file) if db_file else None
+        self._writes = 0
+        self._lock = threading.Lock()
+        if self.pool:
+            self.pool.get_connection().execute(
+                "CREATE TABLE IF NOT EXISTS conversations (user_id INTEGER PRIMARY KEY, turns TEXT, updated REAL)"
+            )
+
+    def _trim(self, turns):
+        """Drop the oldest turns until the history fits the per-user turn and byte budget."""
+        turns = turns[-self.max_turns:] if self.max_turns > 0 else ()
+        while turns and history_size(turns) > self.max_user_bytes:
+            turns = turns[1:]
+        return tuple(turns)
+
+    def get(self, user_id):
+        turns = self.memory.get(user_id)
+        if turns is not None or not self.pool:
+            return turns or ()
+        try:
+            row = self.pool.get_connection().execute(
+                "SELECT turns FROM conversations WHERE user_id=? AND updated > ?", (user_id, time.time() - self.ttl if self.ttl else 0)
+            ).fetchone()
+        except Exception as e:
+            logging.error(f"Error reading conversation history: {e}")
+            return ()
+        turns = self._trim(tuple(tuple(turn) for turn in json.loads(row[0]))) if row else ()
+        self.memory.put(user_id, turns)
+        return turns
+
+    def append(self, user_id, user_text, reply):
+        with self._lock:
+            turns = self._trim(self.get(user_id) + ((user_text, reply),))
+            self.memory.put(user_id, turns)
+        if not self.pool:
+            return
+        try:
+            connection = self.pool.get_connection()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO conversations (user_id, turns, updated) VALUES (?, ?, ?)",
+                    (user_id, json.dumps(turns, ensure_ascii=False), time.time()),
+                )
+                self._writes += 1
+                if self.ttl and self._writes % 1000 == 0:
+                    connection.execute("DELETE FROM conversations WHERE updated <= ?", (time.time() - self.ttl,))
+        except Exception as e:
+            logging.error(f"Error writing conversation history: {e}")
+
+    def clear(self, user_id):
+        self.memory.pop(user_id)
+        if not self.pool:
+            return
+        try:
+            connection = self.pool.get_connection()
+            with connection:
+                connection.execute("DELETE FROM conversations WHERE user_id=?", (user_id,))
+        except Exception as e:
+            logging.error(f"Error clearing conversation history: {e}")
+
+    def stats(self):
+        return self.memory.stats()
+
+    def close(self):
+        if self.pool:
+            self.pool.close_all()
+
+conversation_memory = ConversationMemory()
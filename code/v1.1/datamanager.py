@@ -1,71 +1,700 @@
 # bot/datamanager.py
 
+import os
+import re
+import zlib
+import time
+import queue
+import atexit
 import sqlite3
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from contextlib import contextmanager
 from sqlite3 import Error
 import logging
 
-class DatabaseManager:
-    def __init__(self, db_file='user_data.db'):
+from cache import LRUCache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class ConnectionPool:
+    SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+    def __init__(self, db_file, synchronous='NORMAL', cache_size=-8000, busy_timeout=5.0):
+        if str(synchronous).upper() not in self.SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid synchronous mode: {synchronous}")
         self.db_file = db_file
+        self.synchronous = str(synchronous).upper()
+        self.cache_size = int(cache_size)
+        self.busy_timeout = float(busy_timeout)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        """Return the long-lived connection owned by the calling thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_file, timeout=self.busy_timeout, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"PRAGMA synchronous={self.synchronous}")
+            connection.execute(f"PRAGMA cache_size={self.cache_size}")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except Error as e:
+                logging.error(f"Error: {e}")
+        self._local = threading.local()
+
+DEFAULT_DICTIONARY = (
+    "I'm sorry, but an unexpected problem has occurred. If you wish, you can try again later. "
+    "Apologies, you lack the necessary authorization to utilize my services. "
+    "No results found for that search. Read more: [Wikipedia](https://en.wikipedia.org/wiki/ "
+    "It is important to note that this is not an exhaustive list. There are many different ways to "
+    "Here are some of the most common examples: for example, such as, in addition, however, therefore, "
+    "which is why, as well as, depending on the, it is also possible that, the most important thing is to "
+    "I hope this helps! Let me know if you have any other questions. "
+    "Sure, here is a summary of the text: Here is a paraphrased version of the text: "
+    "\n\n* **\n\n1. **\n2. **\n3. **\n4. **\n5. ** of the and to in is that for with you are this "
+).encode('utf-8')
+
+class ResponseCodec:
+    """Transparent zlib compression of stored responses.
+
+    Compressed payloads are BLOBs laid out as a format-version byte, the adler32
+    of the preset dictionary and a raw deflate stream. TEXT values are rows written
+    before compression existed, or responses too short to be worth compressing, and
+    are returned untouched.
+    """
+    VERSION = 1
+
+    def __init__(self, enabled=False, dictionary=None, level=6, min_size=96):
+        self.enabled = enabled
+        self.level = int(level)
+        self.min_size = int(min_size)
+        self.dictionaries = {}
+        self.dictionary = self.add_dictionary(DEFAULT_DICTIONARY)
+        if dictionary:
+            self.dictionary = self.add_dictionary(dictionary)
+
+    def add_dictionary(self, dictionary):
+        dictionary_id = zlib.adler32(dictionary)
+        self.dictionaries[dictionary_id] = dictionary
+        return dictionary_id
+
+    def encode(self, response):
+        if not self.enabled or not isinstance(response, str) or len(response) < self.min_size:
+            return response
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, self.dictionaries[self.dictionary])
+        payload = compressor.compress(response.encode('utf-8')) + compressor.flush()
+        return bytes([self.VERSION]) + self.dictionary.to_bytes(4, 'big') + payload
+
+    def decode(self, value):
+        if not isinstance(value, bytes):
+            return value
+        if value[:1] != bytes([self.VERSION]):
+            logging.error(f"Unknown response format version {value[:1]!r}")
+            return None
+        dictionary = self.dictionaries.get(int.from_bytes(value[1:5], 'big'))
+        if dictionary is None:
+            logging.error("Response was compressed with an unknown dictionary")
+            return None
+        try:
+            decompressor = zlib.decompressobj(-15, zdict=dictionary)
+            return (decompressor.decompress(value[5:]) + decompressor.flush()).decode('utf-8')
+        except (zlib.error, UnicodeDecodeError) as e:
+            logging.error(f"Response could not be decompressed: {e}")
+            return None
+
+def train_dictionary(samples, size=16 * 1024, min_count=3):
+    """Build a zlib preset dictionary from the phrases that recur across samples."""
+    counts = Counter()
+    for sample in samples:
+        words = re.findall(r'\S+\s*', sample)
+        for length in (2, 4, 8):
+            counts.update(''.join(words[i:i + length]) for i in range(0, len(words) - length + 1))
+    phrases = [phrase for phrase, count in counts.most_common() if count >= min_count]
+    phrases.sort(key=lambda phrase: counts[phrase] * len(phrase), reverse=True)
+    chosen, total = [], 0
+    for phrase in phrases:
+        encoded = phrase.encode('utf-8')
+        if total + len(encoded) > size:
+            continue
+        if any(phrase in other for other in chosen):
+            continue
+        chosen.append(phrase)
+        total += len(encoded)
+    # zlib finds matches near the end of the dictionary cheapest, so the most valuable phrases go last.
+    return ''.join(reversed(chosen)).encode('utf-8')
+
+class WriteBehindQueue:
+    _STOP = object()
+
+    def __init__(self, flush_rows, batch_size=64, flush_interval=0.005):
+        self.flush_rows = flush_rows
+        self.batch_size = int(batch_size)
+        self.flush_interval = float(flush_interval)
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+
+    def put(self, row):
+        if self._closed:
+            self.flush_rows([row])
+            return
+        with self._lock:
+            self._pending[(row[0], row[1])] = row
+        self._queue.put(row)
+
+    def get_pending(self, user_id, data_id):
+        with self._lock:
+            row = self._pending.get((user_id, data_id))
+        return (row[2], row[3]) if row else None
+
+    def pending_for_user(self, user_id):
+        with self._lock:
+            return [row for key, row in self._pending.items() if key[0] == user_id]
+
+    def flush(self):
+        """Block until every row queued so far has been committed."""
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not self._STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            rows = [row for row in batch if row is not self._STOP]
+            running = len(rows) == len(batch)
+            self._write(rows)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, rows):
+        if not rows:
+            return
+        try:
+            self.flush_rows(rows)
+        except Exception as e:
+            logging.error(f"Error in write-behind flush: {e}")
+        with self._lock:
+            for row in rows:
+                key = (row[0], row[1])
+                if self._pending.get(key) is row:
+                    del self._pending[key]
+
+class MaintenanceWorker:
+    def __init__(self, db_manager, trim_interval=30.0, vacuum_interval=0):
+        self.db_manager = db_manager
+        self.trim_interval = float(trim_interval)
+        self.vacuum_interval = float(vacuum_interval)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        last_vacuum = time.monotonic()
+        while not self._stop.wait(self.trim_interval):
+            try:
+                self.db_manager.trim_dirty_users()
+                if self.vacuum_interval > 0 and time.monotonic() - last_vacuum >= self.vacuum_interval:
+                    self.db_manager.compact()
+                    last_vacuum = time.monotonic()
+            except Exception as e:
+                logging.error(f"Error in database maintenance: {e}")
+
+class DataIdGenerator:
+    """Monotonic Snowflake-style ids: 41 bits of milliseconds, 10 bits of worker id, 12 bits of sequence."""
+    EPOCH_MS = 1672531200000  # 2023-01-01T00:00:00Z
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+
+    def __init__(self, worker_id=None, lock_dir=None):
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._last_ms = -1
+        self._sequence = 0
+        if worker_id is None and os.getenv('WORKER_ID'):
+            worker_id = int(os.getenv('WORKER_ID'))
+        if worker_id is None:
+            worker_id = self._claim_worker_id(lock_dir or os.path.join(tempfile.gettempdir(), 'sakura-worker-ids'))
+        if not 0 <= worker_id < 1 << self.WORKER_BITS:
+            raise ValueError(f"worker_id must be between 0 and {(1 << self.WORKER_BITS) - 1}")
+        self.worker_id = worker_id
+
+    def _claim_worker_id(self, lock_dir):
+        # Every process on the host holds an exclusive lock on its own id file; the OS drops it when the process exits.
+        if fcntl is None:
+            return os.getpid() & ((1 << self.WORKER_BITS) - 1)
+        os.makedirs(lock_dir, exist_ok=True)
+        for worker_id in range(1 << self.WORKER_BITS):
+            lock_file = open(os.path.join(lock_dir, f"{worker_id}.lock"), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                continue
+            self._lock_file = lock_file
+            return worker_id
+        raise RuntimeError("No free worker id; set WORKER_ID explicitly")
+
+    def next_id(self):
+        with self._lock:
+            now = int(time.time() * 1000)
+            if now <= self._last_ms:
+                # Same millisecond, or the clock stepped backwards: keep counting from the last timestamp.
+                now = self._last_ms
+                self._sequence = (self._sequence + 1) & ((1 << self.SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return ((now - self.EPOCH_MS) << (self.WORKER_BITS + self.SEQUENCE_BITS)) | (self.worker_id << self.SEQUENCE_BITS) | self._sequence
+
+class StorageBackend(ABC):
+    """Interface every response storage engine implements for BotHandler."""
+    RETENTION = 20
+
+    @abstractmethod
+    def store_user_data(self, user_id, data_id, response, lang):
+        pass
+
+    @abstractmethod
+    def retrieve_user_data(self, user_id):
+        pass
+
+    @abstractmethod
+    def retrieve_user_data_by_data_id(self, user_id, data_id):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class MemoryStorage(StorageBackend):
+    def __init__(self, retention=None):
+        self.retention = int(retention or os.getenv('DB_RETENTION', self.RETENTION))
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def store_user_data(self, user_id, data_id, response, lang):
+        with self._lock:
+            responses = self._users.setdefault(user_id, {})
+            responses[data_id] = (response, lang)
+            while len(responses) > self.retention:
+                del responses[min(responses)]
+
+    def retrieve_user_data(self, user_id):
+        with self._lock:
+            responses = self._users.get(user_id)
+            if responses:
+                return [(data_id, *responses[data_id]) for data_id in sorted(responses)]
+        logging.warning(f"No data stored for user {user_id}.")
+        return None
+
+    def retrieve_user_data_by_data_id(self, user_id, data_id):
+        with self._lock:
+            result = self._users.get(user_id, {}).get(data_id)
+        if result is None:
+            logging.warning(f"No data {data_id} stored for user {user_id}.")
+        return result
+
+class DatabaseManager(StorageBackend):
+
+    def __init__(self, db_file='user_data.db', synchronous=None, cache_size=None, write_behind=None, codec=None,
+                 response_cache_entries=None, response_cache_bytes=None):
+        self.db_file = db_file
+        self.codec = codec or self._codec_from_env()
+        self.cache = LRUCache(
+            max_entries=response_cache_entries if response_cache_entries is not None else os.getenv('RESPONSE_CACHE_ENTRIES', 4096),
+            max_bytes=response_cache_bytes if response_cache_bytes is not None else os.getenv('RESPONSE_CACHE_BYTES', 16 * 1024 * 1024),
+        )
+        self.pool = ConnectionPool(
+            db_file,
+            synchronous=synchronous or os.getenv('DB_SYNCHRONOUS', 'NORMAL'),
+            cache_size=cache_size if cache_size is not None else os.getenv('DB_CACHE_SIZE', -8000),
+        )
+        self.create_responses_table()
+        self.create_retention_table()
+        self.load_dictionaries()
+        self.retention = int(os.getenv('DB_RETENTION', self.RETENTION))
+        self.user_retention = {}
+        self.reload_retention()
+        self._dirty_users = set()
+        self._dirty_lock = threading.Lock()
+        trim_interval = float(os.getenv('DB_TRIM_INTERVAL', 30))
+        self.maintenance = None
+        if trim_interval > 0:
+            self.maintenance = MaintenanceWorker(self, trim_interval=trim_interval, vacuum_interval=os.getenv('DB_VACUUM_INTERVAL', 0))
+        if write_behind is None:
+            write_behind = os.getenv('DB_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+        self.writer = None
+        if write_behind:
+            self.writer = WriteBehindQueue(
+                self._store_rows,
+                batch_size=os.getenv('DB_WRITE_BATCH_SIZE', 64),
+                flush_interval=float(os.getenv('DB_WRITE_FLUSH_MS', 5)) / 1000,
+            )
+            atexit.register(self.close)
+
+    def _codec_from_env(self):
+        dictionary = None
+        dictionary_path = os.getenv('DB_COMPRESSION_DICT')
+        if dictionary_path:
+            with open(dictionary_path, 'rb') as f:
+                dictionary = f.read()
+        return ResponseCodec(
+            enabled=os.getenv('DB_COMPRESSION', 'false').lower() in ('1', 'true', 'yes'),
+            dictionary=dictionary,
+            level=os.getenv('DB_COMPRESSION_LEVEL', 6),
+        )
 
     def _execute_query(self, query, params=None):
         try:
-            with sqlite3.connect(self.db_file) as connection:
-                cursor = connection.cursor()
-                if params:
-                    cursor.execute(query, params)
-                else:
-                    cursor.execute(query)
-                connection.commit()
-                return cursor
+            connection = self.pool.get_connection()
+            cursor = connection.cursor()
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            connection.commit()
+            return cursor
         except Error as e:
             logging.error(f"Error: {e}")
 
     def create_connection(self):
-        return sqlite3.connect(self.db_file)
+        return self.pool.get_connection()
+
+    def flush(self):
+        if self.writer:
+            self.writer.flush()
 
-    def create_user_data_table(self, user_id):
-        table_name = f"user_{user_id}"
-        create_table_sql = f"""
-        CREATE TABLE IF NOT EXISTS {table_name} (
-            data_id INTEGER PRIMARY KEY,
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        if self.maintenance:
+            self.maintenance.close()
+            self.maintenance = None
+            self.trim_dirty_users()
+        self.pool.close_all()
+
+    @contextmanager
+    def transaction(self):
+        connection = self.pool.get_connection()
+        try:
+            with connection:
+                yield connection.cursor()
+        except Error as e:
+            logging.error(f"Error: {e}")
+
+    def create_responses_table(self):
+        create_table_sql = """
+        CREATE TABLE IF NOT EXISTS responses (
+            user_id INTEGER NOT NULL,
+            data_id INTEGER NOT NULL,
             response TEXT,
-            lang TEXT
+            lang TEXT,
+            PRIMARY KEY (user_id, data_id)
+        ) WITHOUT ROWID;
+        """
+        self._execute_query(create_table_sql)
+
+    def load_dictionaries(self):
+        """Keep every compression dictionary this file has used, so rows stay readable after DB_COMPRESSION_DICT changes."""
+        self._execute_query("CREATE TABLE IF NOT EXISTS dictionaries (id INTEGER PRIMARY KEY, dictionary BLOB NOT NULL)")
+        cursor = self._execute_query("SELECT dictionary FROM dictionaries")
+        for (dictionary,) in (cursor.fetchall() if cursor else []):
+            self.codec.add_dictionary(dictionary)
+        if self.codec.enabled:
+            # Recorded before the first row is encoded with it.
+            self._execute_query(
+                "INSERT OR IGNORE INTO dictionaries (id, dictionary) VALUES (?, ?)",
+                (self.codec.dictionary, self.codec.dictionaries[self.codec.dictionary]),
+            )
+
+    def create_retention_table(self):
+        create_table_sql = """
+        CREATE TABLE IF NOT EXISTS user_retention (
+            user_id INTEGER PRIMARY KEY,
+            retention INTEGER NOT NULL
         );
         """
         self._execute_query(create_table_sql)
 
+    def reload_retention(self):
+        """Pick up overrides written by another process, such as `dbtool.py retention`."""
+        cursor = self._execute_query("SELECT user_id, retention FROM user_retention")
+        if cursor:
+            self.user_retention = dict(cursor.fetchall())
+
+    def get_retention(self, user_id):
+        return self.user_retention.get(user_id, self.retention)
+
+    def set_user_retention(self, user_id, retention):
+        if retention is None:
+            self._execute_query("DELETE FROM user_retention WHERE user_id=?", (user_id,))
+            self.user_retention.pop(user_id, None)
+        else:
+            self._execute_query("INSERT OR REPLACE INTO user_retention (user_id, retention) VALUES (?, ?)", (user_id, int(retention)))
+            self.user_retention[user_id] = int(retention)
+        self._mark_dirty([user_id])
+
     def store_user_data(self, user_id, data_id, response, lang):
-        table_name = f"user_{user_id}"
-        self.create_user_data_table(user_id)
-        cursor = self._execute_query(f"SELECT COUNT(*) FROM {table_name}")
-        entry_count = cursor.fetchone()[0]
-        if entry_count >= 20:
-            self._execute_query(f"DELETE FROM {table_name} WHERE data_id = (SELECT MIN(data_id) FROM {table_name})")
-        self._execute_query(f"INSERT INTO {table_name} (data_id, response, lang) VALUES (?, ?, ?)", (data_id, response, lang))
-        logging.info("Data stored")
+        row = (user_id, data_id, response, lang)
+        self.cache.put((user_id, data_id), (response, lang))
+        if self.writer:
+            self.writer.put(row)
+            logging.info("Data queued")
+        else:
+            self._store_rows([row])
+            logging.info("Data stored")
+
+    def _store_rows(self, rows):
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO responses (user_id, data_id, response, lang) VALUES (?, ?, ?, ?)",
+                [(user_id, data_id, self.codec.encode(response), lang) for user_id, data_id, response, lang in rows],
+            )
+        self._mark_dirty(row[0] for row in rows)
+        if self.maintenance is None:
+            self.trim_dirty_users()
+
+    def _mark_dirty(self, user_ids):
+        with self._dirty_lock:
+            self._dirty_users.update(user_ids)
+
+    def trim_dirty_users(self):
+        """Apply retention to every user written since the last trim, off the reply path."""
+        with self._dirty_lock:
+            user_ids, self._dirty_users = self._dirty_users, set()
+        return self.trim_users(user_ids)
+
+    def trim_users(self, user_ids):
+        if not user_ids:
+            return 0
+        self.reload_retention()
+        expired = []
+        with self.transaction() as cursor:
+            for user_id in user_ids:
+                expired.extend((user_id, data_id) for data_id in self._trim_user(cursor, user_id))
+        for key in expired:
+            self.cache.pop(key)
+        return len(expired)
+
+    def compact(self, vacuum=True):
+        """Trim every user to their retention, then checkpoint the WAL and optionally VACUUM."""
+        self.reload_retention()
+        cursor = self._execute_query("SELECT user_id, COUNT(*) FROM responses GROUP BY user_id")
+        user_ids = [user_id for user_id, count in cursor.fetchall() if count > self.get_retention(user_id)] if cursor else []
+        expired = self.trim_users(user_ids)
+        self._execute_query("PRAGMA wal_checkpoint(TRUNCATE)")
+        if vacuum:
+            self._execute_query("VACUUM")
+        logging.info(f"Compacted database: {expired} expired responses removed")
+        return expired
+
+    def _trim_user(self, cursor, user_id):
+        cutoff = cursor.execute(
+            "SELECT data_id FROM responses WHERE user_id = ? ORDER BY data_id DESC LIMIT 1 OFFSET ?",
+            (user_id, self.get_retention(user_id) - 1),
+        ).fetchone()
+        if cutoff is None:
+            return []
+        expired = [data_id for (data_id,) in cursor.execute("SELECT data_id FROM responses WHERE user_id = ? AND data_id < ?", (user_id, cutoff[0]))]
+        cursor.execute("DELETE FROM responses WHERE user_id = ? AND data_id < ?", (user_id, cutoff[0]))
+        return expired
 
     def retrieve_user_data(self, user_id):
-        table_name = f"user_{user_id}"
-        cursor = self._execute_query(f"SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-        table_exists = cursor.fetchone()
-        if table_exists:
-            cursor = self._execute_query(f"SELECT data_id, response, lang FROM {table_name}")
-            result = cursor.fetchall()
+        retention = self.get_retention(user_id)
+        cursor = self._execute_query("SELECT data_id, response, lang FROM responses WHERE user_id=? ORDER BY data_id DESC LIMIT ?", (user_id, retention))
+        result = [(data_id, self.codec.decode(response), lang) for data_id, response, lang in reversed(cursor.fetchall())] if cursor else []
+        # A row that cannot be decoded is as good as missing.
+        result = [row for row in result if row[1] is not None]
+        if self.writer:
+            rows = {data_id: (data_id, response, lang) for data_id, response, lang in result}
+            rows.update({row[1]: row[1:] for row in self.writer.pending_for_user(user_id)})
+            result = [rows[data_id] for data_id in sorted(rows)][-retention:]
+        if result:
             return result
+        logging.warning(f"No data stored for user {user_id}.")
+        return None
+
+    def retrieve_user_data_by_data_id(self, user_id, data_id):
+        cached = self.cache.get((user_id, data_id))
+        if cached is not None:
+            return cached
+        if self.writer:
+            pending = self.writer.get_pending(user_id, data_id)
+            if pending:
+                return pending
+        cursor = self._execute_query("SELECT response, lang FROM responses WHERE user_id=? AND data_id=?", (user_id, data_id))
+        result = cursor.fetchone() if cursor else None
+        if result is not None:
+            response = self.codec.decode(result[0])
+            result = (response, result[1]) if response is not None else None
+        if result is None:
+            logging.warning(f"No data {data_id} stored for user {user_id}.")
         else:
-            logging.warning(f"Table {table_name} does not exist.")
-            return None
+            self.cache.put((user_id, data_id), result)
+        return result
+
+    def list_legacy_tables(self):
+        cursor = self._execute_query("SELECT name FROM sqlite_master WHERE type='table' AND name GLOB 'user_[0-9]*'")
+        return [name for (name,) in cursor.fetchall()] if cursor else []
+
+    def migrate_legacy_tables(self, batch_size=500):
+        """Stream every per-user `user_{id}` table into `responses`, one table per transaction."""
+        migrated = 0
+        for table_name in self.list_legacy_tables():
+            user_id = int(table_name[len("user_"):])
+            with self.transaction() as cursor:
+                rows = cursor.execute(f"SELECT data_id, response, lang FROM {table_name}")
+                writer = self.pool.get_connection().cursor()
+                while True:
+                    batch = rows.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    writer.executemany(
+                        "INSERT OR IGNORE INTO responses (user_id, data_id, response, lang) VALUES (?, ?, ?, ?)",
+                        [(user_id, data_id, response, lang) for data_id, response, lang in batch],
+                    )
+                    migrated += len(batch)
+                writer.execute(f"DROP TABLE {table_name}")
+            logging.info(f"Migrated {table_name} into responses")
+        return migrated
+
+def shard_index(user_id, shard_count):
+    return zlib.crc32(str(user_id).encode('utf-8')) % shard_count
+
+def shard_path(db_file, index, shard_count):
+    if shard_count == 1:
+        return db_file
+    root, ext = os.path.splitext(db_file)
+    return f"{root}.{index}-of-{shard_count}{ext}"
+
+class ShardedDatabaseManager(StorageBackend):
+    """Spread users over several SQLite files so writers for different users never share a lock."""
+
+    def __init__(self, db_file='user_data.db', shards=None, **kwargs):
+        self.db_file = db_file
+        self.shard_count = int(shards or os.getenv('DB_SHARDS', 4))
+        # RESPONSE_CACHE_ENTRIES and RESPONSE_CACHE_BYTES cap the whole engine, so each shard gets its share.
+        # Rounding up keeps 0 meaning disabled (entries) or unlimited (bytes).
+        kwargs.setdefault('response_cache_entries', (int(os.getenv('RESPONSE_CACHE_ENTRIES', 4096)) + self.shard_count - 1) // self.shard_count)
+        kwargs.setdefault('response_cache_bytes', (int(os.getenv('RESPONSE_CACHE_BYTES', 16 * 1024 * 1024)) + self.shard_count - 1) // self.shard_count)
+        self.shards = [DatabaseManager(shard_path(db_file, index, self.shard_count), **kwargs) for index in range(self.shard_count)]
+
+    def shard_for(self, user_id):
+        return self.shards[shard_index(user_id, self.shard_count)]
+
+    def store_user_data(self, user_id, data_id, response, lang):
+        self.shard_for(user_id).store_user_data(user_id, data_id, response, lang)
+
+    def retrieve_user_data(self, user_id):
+        return self.shard_for(user_id).retrieve_user_data(user_id)
 
     def retrieve_user_data_by_data_id(self, user_id, data_id):
-        table_name = f"user_{user_id}"
-        cursor = self._execute_query(f"SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-        table_exists = cursor.fetchone()
+        return self.shard_for(user_id).retrieve_user_data_by_data_id(user_id, data_id)
 
-        if table_exists:
-            cursor = self._execute_query(f"SELECT response, lang FROM {table_name} WHERE data_id=?", (data_id,))
-            result = cursor.fetchone()
-            return result
-        else:
-            logging.warning(f"Table {table_name} does not exist.")
-            return None
+    def get_retention(self, user_id):
+        return self.shard_for(user_id).get_retention(user_id)
+
+    def set_user_retention(self, user_id, retention):
+        self.shard_for(user_id).set_user_retention(user_id, retention)
+
+    def trim_dirty_users(self):
+        return sum(shard.trim_dirty_users() for shard in self.shards)
+
+    def compact(self, vacuum=True):
+        return sum(shard.compact(vacuum=vacuum) for shard in self.shards)
+
+    def flush(self):
+        for shard in self.shards:
+            shard.flush()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+def reshard(db_file, old_count, new_count, batch_size=500):
+    """Copy every stored row from the old shard layout into the new one, leaving the old files in place."""
+    if old_count == new_count:
+        raise ValueError("Old and new shard counts are the same")
+    sources = [DatabaseManager(shard_path(db_file, index, old_count), write_behind=False) for index in range(old_count)]
+    target = ShardedDatabaseManager(db_file, shards=new_count, write_behind=False)
+    copied = 0
+    for source in sources:
+        # Rows are copied still compressed, so every target shard needs the dictionaries they were compressed with.
+        dictionaries = source._execute_query("SELECT id, dictionary FROM dictionaries").fetchall()
+        for shard in target.shards:
+            with shard.transaction() as cursor:
+                cursor.executemany("INSERT OR IGNORE INTO dictionaries (id, dictionary) VALUES (?, ?)", dictionaries)
+            for _, dictionary in dictionaries:
+                shard.codec.add_dictionary(dictionary)
+        rows = source._execute_query("SELECT user_id, data_id, response, lang FROM responses")
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                break
+            grouped = {}
+            for row in batch:
+                grouped.setdefault(shard_index(row[0], new_count), []).append(row)
+            for index, shard_rows in grouped.items():
+                with target.shards[index].transaction() as cursor:
+                    cursor.executemany("INSERT OR REPLACE INTO responses (user_id, data_id, response, lang) VALUES (?, ?, ?, ?)", shard_rows)
+            copied += len(batch)
+        for user_id, retention in source.user_retention.items():
+            target.set_user_retention(user_id, retention)
+        source.close()
+    target.close()
+    return copied
+
+STORAGE_ENGINES = {
+    'sqlite': DatabaseManager,
+    'sharded': ShardedDatabaseManager,
+    'memory': MemoryStorage,
+}
+
+def create_storage(engine=None):
+    engine = engine or os.getenv('STORAGE_ENGINE', 'sqlite')
+    if engine not in STORAGE_ENGINES:
+        raise ValueError(f"Unknown storage engine: {engine}")
+    return STORAGE_ENGINES[engine]()
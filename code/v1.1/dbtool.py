@@ -0,0 +1,55 @@
+# bot/dbtool.py
+
+import sys
+import logging
+
+from datamanager import DatabaseManager, reshard as reshard_database, train_dictionary
+
+def migrate(db_file='user_data.db', batch_size='500'):
+    db_manager = DatabaseManager(db_file)
+    legacy_tables = db_manager.list_legacy_tables()
+    logging.info(f"Found {len(legacy_tables)} legacy user tables in {db_file}")
+    migrated = db_manager.migrate_legacy_tables(batch_size=int(batch_size))
+    logging.info(f"Moved {migrated} rows into the responses table")
+    db_manager.close()
+
+def train_dict(db_file='user_data.db', output='response.dict', size='16384'):
+    db_manager = DatabaseManager(db_file)
+    cursor = db_manager._execute_query("SELECT response FROM responses ORDER BY data_id DESC LIMIT 5000")
+    samples = [db_manager.codec.decode(response) for (response,) in cursor.fetchall()]
+    dictionary = train_dictionary([sample for sample in samples if sample], size=int(size))
+    with open(output, 'wb') as f:
+        f.write(dictionary)
+    logging.info(f"Wrote a {len(dictionary)} byte dictionary trained on {len(samples)} responses to {output}")
+    db_manager.close()
+
+def compact(db_file='user_data.db'):
+    db_manager = DatabaseManager(db_file)
+    db_manager.compact()
+    db_manager.close()
+
+def retention(db_file, user_id, limit='default'):
+    db_manager = DatabaseManager(db_file)
+    db_manager.set_user_retention(int(user_id), None if limit == 'default' else int(limit))
+    db_manager.trim_dirty_users()
+    logging.info(f"User {user_id} now keeps {db_manager.get_retention(int(user_id))} responses")
+    db_manager.close()
+
+def reshard(db_file, old_count, new_count):
+    copied = reshard_database(db_file, int(old_count), int(new_count))
+    logging.info(f"Copied {copied} rows from {old_count} to {new_count} shards; remove the old files once the bot runs with DB_SHARDS={new_count}")
+
+COMMANDS = {
+    'migrate': migrate,
+    'train-dict': train_dict,
+    'compact': compact,
+    'retention': retention,
+    'reshard': reshard,
+}
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(f"usage: python dbtool.py {{{','.join(COMMANDS)}}} [args...]")
+        sys.exit(1)
+    COMMANDS[sys.argv[1]](*sys.argv[2:])
@@ -1,20 +1,65 @@
 # bot/helper.py
 
+import io
 import os
+import time
 import base64
+import hashlib
+import logging
+import threading
+from collections import deque
 import requests
+from requests.adapters import HTTPAdapter
 import wikipediaapi
 import concurrent.futures
+import subprocess
 import re
-import html
 
 from PIL import Image, ImageEnhance
 from pydub import AudioSegment
 from gtts import gTTS
 from dotenv import load_dotenv
+from cache import LRUCache
+from datamanager import ConnectionPool
+from language_detector import LanguageDetector
+
+try:
+    import numpy as np
+    from timestretch import time_stretch
+except ImportError:
+    time_stretch = None
 
 load_dotenv('.env')
 
+class HttpClient:
+    """One keep-alive session with per-host connection pools, shared by every outbound call."""
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, connect_timeout=None, read_timeout=None):
+        self.timeout = (
+            float(connect_timeout or os.getenv('HTTP_CONNECT_TIMEOUT', 5)),
+            float(read_timeout or os.getenv('HTTP_READ_TIMEOUT', 30)),
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=int(pool_connections or os.getenv('HTTP_POOL_HOSTS', 10)),
+            pool_maxsize=int(pool_maxsize or os.getenv('HTTP_POOL_SIZE', 16)),
+        )
+        self.session = requests.Session()
+        self.attach(self.session)
+
+    def attach(self, session):
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.post(url, **kwargs)
+
+http_client = HttpClient()
+
 class Helper:
     def __init__(self):
         self.allowed_users = os.getenv('USER_ID').split(',')
@@ -26,9 +71,73 @@ class Helper:
     def is_admin(self, user_id):
         return '*' in self.allowed_admins or str(user_id) in self.allowed_admins
 
+def ffmpeg_pipe(data, input_args, output_args):
+    """Run ffmpeg on bytes through stdin/stdout, so audio never touches the disk."""
+    command = [os.getenv('FFMPEG_BINARY', 'ffmpeg'), '-hide_banner', '-loglevel', 'error', *input_args, '-i', 'pipe:0', *output_args, 'pipe:1']
+    process = subprocess.run(command, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {process.returncode}: {process.stderr.decode('utf-8', 'replace').strip()}")
+    return process.stdout
+
+class VoiceCache:
+    """Processed voice replies keyed by content, plus the Telegram file_id each one got on its first upload."""
+
+    def __init__(self, max_entries=None, max_bytes=None, max_file_ids=None):
+        self.audio = LRUCache(
+            max_entries=max_entries if max_entries is not None else os.getenv('VOICE_CACHE_ENTRIES', 256),
+            max_bytes=max_bytes if max_bytes is not None else os.getenv('VOICE_CACHE_BYTES', 32 * 1024 * 1024),
+        )
+        # A file_id is a few dozen bytes, so far more of them are kept than audio clips.
+        self.file_ids = LRUCache(max_entries=max_file_ids if max_file_ids is not None else os.getenv('VOICE_FILE_IDS', 20000))
+
+    def key(self, text, lang, speed, audio_format):
+        normalized = ' '.join(str(text).split())
+        return hashlib.sha256(f"{lang}\x1f{speed:g}\x1f{audio_format}\x1f{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the uploaded file_id, else the cached audio bytes, else None."""
+        file_id = self.file_ids.get(key)
+        if file_id is not None:
+            return file_id
+        return self.audio.get(key)
+
+    def put(self, key, audio):
+        self.audio.put(key, audio)
+
+    def set_file_id(self, key, file_id):
+        self.file_ids.put(key, file_id)
+
+    def forget_file_id(self, key):
+        self.file_ids.pop(key)
+
+    def stats(self):
+        return {'audio': self.audio.stats(), 'file_ids': self.file_ids.stats()}
+
+# Encoder arguments and default bitrate per voice format; OGG/Opus is what Telegram records voice notes in.
+VOICE_FORMATS = {
+    'ogg': (['-c:a', 'libopus', '-application', 'voip', '-f', 'ogg'], '32k'),
+    'mp3': (['-c:a', 'libmp3lame', '-f', 'mp3'], '128k'),
+}
+
 class Audio:
+    def __init__(self):
+        self.speed = float(os.getenv('TTS_SPEED', 1.22))
+        self.sample_rate = 24000 # gTTS returns 24 kHz mono MP3
+        self.format = os.getenv('TTS_FORMAT', 'ogg').lower()
+        if self.format not in VOICE_FORMATS:
+            raise ValueError(f"Unknown TTS_FORMAT {self.format!r}, expected one of {', '.join(VOICE_FORMATS)}")
+        self.bitrate = os.getenv('TTS_BITRATE') or VOICE_FORMATS[self.format][1]
+        # libopus defaults to its slowest complexity (10); 5 encodes several times faster for a few percent more bytes.
+        self.opus_complexity = int(os.getenv('TTS_OPUS_COMPLEXITY', 5))
+        self.pcm_args = ['-f', 's16le', '-ac', '1', '-ar', str(self.sample_rate)]
+        self.cache = VoiceCache()
+        self.segment_chars = int(os.getenv('TTS_SEGMENT_CHARS', 200))
+        self.stream_first = os.getenv('TTS_STREAM_FIRST', 'false').lower() in ('1', 'true', 'yes')
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=int(os.getenv('TTS_WORKERS', 4)), thread_name_prefix="tts")
+        # Decoding gets its own pool so a finished part is not queued behind synthesis still running for later parts or other users.
+        self.decoder = concurrent.futures.ThreadPoolExecutor(max_workers=int(os.getenv('TTS_DECODE_WORKERS', 2)), thread_name_prefix="tts-decode")
 
-    def tts(self, last_response):
+    def clean_text(self, last_response):
         if last_response is not None:
             user_lang = last_response[1] if last_response[1] is not None else 'en'
             text = last_response[0] if last_response[1] is not None else "There has been no response at the moment."
@@ -45,7 +154,9 @@ class Audio:
         excluded_characters = "`#$^<>*_/\\{}[]|~"
         text = text.translate(str.maketrans('', '', excluded_characters))
         text = re.sub(r'\s+', ' ', text)
+        return text, user_lang
 
+    def synthesize(self, text, user_lang):
         if user_lang != 'en':
             tts = gTTS(text=text, lang=user_lang, slow=False)
         elif user_lang != 'ja':
@@ -53,20 +164,84 @@ class Audio:
             tts = gTTS(text=text, lang=user_lang, slow=False)
         else:
             tts = gTTS(text=text, lang='en', tld='co.uk', slow=False)
-        tts.save('voice_raw.mp3')
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            executor.submit(self.process_audio)
+        buffer = io.BytesIO()
+        tts.write_to_fp(buffer)
+        return buffer.getvalue()
+
+    def _submit(self, text, user_lang):
+        """Return (cache key, cached voice) or (cache key, futures synthesizing each sentence group in order)."""
+        key = self.cache.key(text, user_lang, self.speed, f"{self.format}/{self.bitrate}/{self.opus_complexity}")
+        voice = self.cache.get(key)
+        if voice is not None:
+            return key, voice
+        segments = [segment.strip() for segment in split_segments(text, self.segment_chars) if segment.strip()] or [text]
+        return key, [self.executor.submit(self.synthesize, segment, user_lang) for segment in segments]
+
+    def _collect(self, key, pending):
+        """Return (cache key, voice); the key is None when the voice is an unprocessed fallback that must not be cached."""
+        if not isinstance(pending, list):
+            return key, pending
+        mp3_segments = [future.result() for future in pending]
+        voice = self.process_audio(mp3_segments)
+        if voice is None:
+            # Too short to speed up, or ffmpeg is missing: the unprocessed voice is still worth sending,
+            # but caching it would keep serving it after ffmpeg recovers.
+            return None, b''.join(mp3_segments)
+        self.cache.put(key, voice)
+        return key, voice
+
+    def tts(self, last_response):
+        """Return (cache key, voice): a Telegram file_id if this audio was sent before, else audio bytes."""
+        text, user_lang = self.clean_text(last_response)
+        return self._collect(*self._submit(text, user_lang))
+
+    def tts_parts(self, last_response):
+        """Yield (cache key, voice) for the whole reply, or with TTS_STREAM_FIRST for its first sentence group and then the rest."""
+        text, user_lang = self.clean_text(last_response)
+        segments = split_segments(text, self.segment_chars)
+        if not self.stream_first or len(segments) < 2:
+            parts = [self._submit(text, user_lang)]
+        else:
+            # Both parts are queued at once, so the rest is synthesized while the first part is being sent.
+            parts = [self._submit(segments[0].strip(), user_lang), self._submit(''.join(segments[1:]).strip(), user_lang)]
+        for key, pending in parts:
+            yield self._collect(key, pending)
+
+    def encode(self, pcm, audio_format=None, bitrate=None, opus_complexity=None):
+        audio_format = audio_format or self.format
+        encoder_args, default_bitrate = VOICE_FORMATS[audio_format]
+        bitrate = bitrate or (self.bitrate if audio_format == self.format else default_bitrate)
+        if audio_format == 'ogg':
+            encoder_args = [*encoder_args, '-compression_level', str(opus_complexity if opus_complexity is not None else self.opus_complexity)]
+        return ffmpeg_pipe(pcm, self.pcm_args, [*encoder_args, '-b:a', bitrate])
 
-    def process_audio(self):
+    def filename(self, voice):
+        # A failed process_audio leaves the unprocessed MP3, so name the upload after what it actually contains.
+        return 'voice.ogg' if voice[:4] == b'OggS' else 'voice.mp3'
+
+    def decode(self, mp3_data):
+        return ffmpeg_pipe(mp3_data, ['-f', 'mp3'], self.pcm_args)
+
+    def process_audio(self, mp3_segments):
+        """Decode, join, speed up and encode the synthesized sentence groups; None if that fails."""
+        if isinstance(mp3_segments, bytes):
+            mp3_segments = [mp3_segments]
         try:
-            audio = AudioSegment.from_file("voice_raw.mp3", format="mp3")
-            audio = audio.speedup(playback_speed=1.22)
-            audio.export('voice.mp3', format="mp3")
-            os.remove('voice_raw.mp3')
+            pcm = b''.join(self.decoder.map(self.decode, mp3_segments))
+            if time_stretch is not None:
+                pcm = time_stretch(np.frombuffer(pcm, dtype='<i2'), self.speed, self.sample_rate).tobytes()
+            else:
+                audio = AudioSegment(data=pcm, sample_width=2, frame_rate=self.sample_rate, channels=1)
+                pcm = audio.speedup(playback_speed=self.speed).raw_data
+            return self.encode(pcm)
         except Exception as e:
             print(f"Error in process_audio: {e}")
+            return None
 
 class Image_gen:
+    def __init__(self, http=None):
+        self.http = http or http_client
+        self.timeout = (self.http.timeout[0], float(os.getenv('STABILITY_TIMEOUT', 120)))
 
     def add_watermark(self, input_image_path, output_image_path, watermark_image_path, transparency=25):
         if watermark_image_path is None or not os.path.exists(watermark_image_path):
@@ -134,7 +309,7 @@ class Image_gen:
         body = common_params.copy()
 
         try:
-            response = requests.post(
+            response = self.http.post(
                 "https://api.stability.ai/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image",
                 headers={
                     "Content-Type": "application/json",
@@ -142,6 +317,7 @@ class Image_gen:
                     "Authorization": f"Bearer {api_key}",
                 },
                 json=body,
+                timeout=self.timeout,
             )
 
             if response.status_code != 200:
@@ -163,16 +339,231 @@ class Image_gen:
             print(f"Error in generate_image: {e}")
             return None
 
+class TranslationCache:
+    """In-process LRU in front of a persistent SQLite tier, keyed by (normalized text, source, target)."""
+
+    def __init__(self, db_file=None, max_entries=None, max_bytes=None, ttl=None, max_rows=None):
+        self.ttl = float(ttl if ttl is not None else os.getenv('TRANSLATION_CACHE_TTL', 7 * 24 * 3600))
+        self.max_rows = int(max_rows if max_rows is not None else os.getenv('TRANSLATION_CACHE_ROWS', 100000))
+        self.memory = LRUCache(
+            max_entries=max_entries if max_entries is not None else os.getenv('TRANSLATION_CACHE_ENTRIES', 2048),
+            max_bytes=max_bytes if max_bytes is not None else os.getenv('TRANSLATION_CACHE_BYTES', 8 * 1024 * 1024),
+            ttl=self.ttl,
+        )
+        db_file = db_file if db_file is not None else os.getenv('TRANSLATION_CACHE_DB', 'translation_cache.db')
+        self.pool = ConnectionPool(db_file) if db_file else None
+        self.disk_hits = 0
+        self._writes = 0
+        if self.pool:
+            self.pool.get_connection().execute(
+                "CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, text TEXT, lang TEXT, expires REAL)"
+            )
+
+    def _key(self, text, source, target):
+        normalized = ' '.join(str(text).split())
+        return hashlib.sha256(f"{source}\x1f{target}\x1f{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, text, source, target):
+        key = self._key(text, source, target)
+        result = self.memory.get(key)
+        if result is not None or not self.pool:
+            return result
+        try:
+            row = self.pool.get_connection().execute(
+                "SELECT text, lang FROM translations WHERE key=? AND expires > ?", (key, time.time())
+            ).fetchone()
+        except Exception as e:
+            logging.error(f"Error reading translation cache: {e}")
+            return None
+        if row is not None:
+            self.disk_hits += 1
+            self.memory.put(key, row)
+        return row
+
+    def put(self, text, source, target, result):
+        key = self._key(text, source, target)
+        self.memory.put(key, tuple(result))
+        if not self.pool:
+            return
+        try:
+            connection = self.pool.get_connection()
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO translations (key, text, lang, expires) VALUES (?, ?, ?, ?)", (key, result[0], result[1], time.time() + self.ttl))
+                self._writes += 1
+                if self._writes % 1000 == 0:
+                    self._prune(connection)
+        except Exception as e:
+            logging.error(f"Error writing translation cache: {e}")
+
+    def _prune(self, connection):
+        connection.execute("DELETE FROM translations WHERE expires <= ?", (time.time(),))
+        connection.execute(
+            "DELETE FROM translations WHERE key IN (SELECT key FROM translations ORDER BY expires LIMIT "
+            "max(0, (SELECT COUNT(*) FROM translations) - ?))",
+            (self.max_rows,),
+        )
+
+    def stats(self):
+        stats = self.memory.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['disk_hits'] = self.disk_hits
+        stats['hit_rate'] = (stats['hits'] + self.disk_hits) / lookups if lookups else 0.0
+        return stats
+
+MARKDOWN_PROTECTED = re.compile(r"```.*?```|`[^`\n]+`|\]\([^)\s]+\)|https?://\S+|\[\^?\d+\^?\]", re.DOTALL)
+PLACEHOLDER = re.compile(r"⟦\s*(\d+)\s*⟧")
+
+def protect_markdown(text):
+    """Swap code spans, link targets and URLs for numbered placeholders the translator leaves alone."""
+    protected = []
+
+    def hide(match):
+        protected.append(match.group(0))
+        return f"⟦{len(protected) - 1}⟧"
+
+    return MARKDOWN_PROTECTED.sub(hide, text), protected
+
+def restore_markdown(text, protected):
+    found = set()
+
+    def show(match):
+        index = int(match.group(1))
+        if index >= len(protected):
+            return match.group(0)
+        found.add(index)
+        return protected[index]
+
+    restored = PLACEHOLDER.sub(show, text)
+    return restored if len(found) == len(protected) else None
+
+def split_segments(text, max_chars):
+    """Split text at paragraph, then sentence, then word boundaries into pieces of at most max_chars."""
+    if len(text) <= max_chars:
+        return [text]
+    segments = []
+    for pattern in (r"(?<=\n\n)", r"(?<=[.!?。！？])\s+|(?<=\n)", r"(?<=\s)"):
+        pieces = [piece for piece in re.split(f"({pattern})", text) if piece]
+        if len(pieces) > 1:
+            break
+    else:
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+    current = ''
+    for piece in pieces:
+        if len(current) + len(piece) <= max_chars:
+            current += piece
+            continue
+        if current:
+            segments.append(current)
+        if len(piece) > max_chars:
+            segments.extend(split_segments(piece, max_chars))
+            current = ''
+        else:
+            current = piece
+    if current:
+        segments.append(current)
+    return segments
+
+class LatencyTracker:
+    def __init__(self, window=200, min_samples=20, default=0.3, floor=0.05):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.default = default
+        self.floor = floor
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, fraction):
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return self.default
+            ordered = sorted(self.samples)
+        return max(self.floor, ordered[min(len(ordered) - 1, int(len(ordered) * fraction))])
+
 class Translator:
+    URL = "https://clients5.google.com/translate_a/t"
+    HEADERS = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36'}
+
+    def __init__(self, cache=None, http=None, detector=None):
+        self.cache = cache or TranslationCache()
+        self.http = http or http_client
+        self.segment_chars = int(os.getenv('TRANSLATE_SEGMENT_CHARS', 1500))
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=int(os.getenv('TRANSLATE_WORKERS', 4)), thread_name_prefix="translate")
+        self.deadline = float(os.getenv('TRANSLATE_DEADLINE', 3.0))
+        self.hedge = os.getenv('TRANSLATE_HEDGE', 'true').lower() in ('1', 'true', 'yes')
+        self.latency = LatencyTracker(floor=float(os.getenv('TRANSLATE_HEDGE_MIN_MS', 50)) / 1000)
+        self.request_executor = concurrent.futures.ThreadPoolExecutor(max_workers=int(os.getenv('TRANSLATE_HEDGE_WORKERS', 16)), thread_name_prefix="translate-request")
+        self.metrics = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'deadline_exceeded': 0}
+        self._metrics_lock = threading.Lock()
+        self.detector = detector
+        if detector is None and os.getenv('LANG_DETECT', 'true').lower() in ('1', 'true', 'yes'):
+            self.detector = LanguageDetector()
+        self.local_detections = 0
+
+    def _count(self, metric):
+        with self._metrics_lock:
+            self.metrics[metric] += 1
+
+    def _fetch(self, params, timeout):
+        started = time.monotonic()
+        result = self.http.get(self.URL, params=params, headers=self.HEADERS, timeout=timeout).json()
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    def _request(self, text, source, target, deadline=None):
+        """Query the translator, firing a duplicate after the p95 latency and giving up at the deadline."""
+        params = {'client': 'dict-chrome-ex', 'sl': source, 'tl': target, 'q': text}
+        deadline = deadline if deadline is not None else time.monotonic() + self.deadline
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._count('deadline_exceeded')
+            raise TimeoutError(f"translation exceeded the {self.deadline}s deadline")
+        timeout = (self.http.timeout[0], remaining)
+        self._count('requests')
+        primary = self.request_executor.submit(self._fetch, params, timeout)
+        futures = [primary]
+        if self.hedge:
+            done, _ = concurrent.futures.wait(futures, timeout=min(self.latency.percentile(0.95), remaining))
+            if not done or primary.exception() is not None:
+                self._count('hedged')
+                futures.append(self.request_executor.submit(self._fetch, params, timeout))
+        error = None
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        except concurrent.futures.TimeoutError:
+            self._count('deadline_exceeded')
+            raise TimeoutError(f"translation exceeded the {self.deadline}s deadline")
+        raise error
+
+    def stats(self):
+        with self._metrics_lock:
+            stats = dict(self.metrics)
+        stats['hedge_delay'] = self.latency.percentile(0.95)
+        stats['local_detections'] = self.local_detections
+        stats['cache'] = self.cache.stats()
+        return stats
 
     def translate_input(self, user_input):
-        url = f"https://clients5.google.com/translate_a/t?client=dict-chrome-ex&sl=auto&tl=en&q={user_input}"
-        headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36'}
+        if self.detector and self.detector.is_english(user_input):
+            self.local_detections += 1
+            return user_input, 'en'
+
+        cached = self.cache.get(user_input, 'auto', 'en')
+        if cached is not None:
+            return cached
 
         try:
-            request_result = requests.get(url, headers=headers).json()
-            user_input = request_result[0][0]
-            user_lang = request_result[0][1]
+            request_result = self._request(user_input, 'auto', 'en')
+            translated = request_result[0][0], request_result[0][1]
+            self.cache.put(user_input, 'auto', 'en', translated)
+            user_input, user_lang = translated
         except Exception as e:
             print(f"Error in translate_input: {e}")
             user_input, user_lang = user_input, 'en'
@@ -181,23 +572,56 @@ class Translator:
 
     def translate_output(self, response, user_lang):
         if user_lang != 'en':
-            response = html.escape(response)
-            url = f"https://clients5.google.com/translate_a/t?client=dict-chrome-ex&sl=en&tl={user_lang}&q={response}"
-            headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36'}
-
-            try:
-                request_result = requests.get(url, headers=headers).json()
-                response = request_result[0]
-            except Exception as e:
-                print(f"Error in translate_output: {e}")
-                response = response
+            # Code, links and URLs are swapped for placeholders first, so no segment boundary can fall inside them.
+            text, protected = protect_markdown(response)
+            segments = split_segments(text, self.segment_chars)
+            # One deadline for the whole reply, however many rounds of TRANSLATE_WORKERS its segments need.
+            deadline = time.monotonic() + self.deadline
+            if len(segments) == 1:
+                translated = [self._translate_segment(segments[0], user_lang, deadline)]
+            else:
+                futures = [self.executor.submit(self._translate_segment, segment, user_lang, deadline) for segment in segments]
+                concurrent.futures.wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+                translated = []
+                for future, segment in zip(futures, segments):
+                    # A segment not translated by the deadline is sent as it is; one still queued is dropped.
+                    if future.cancel() or not future.done() or future.exception() is not None:
+                        translated.append(segment)
+                    else:
+                        translated.append(future.result())
+            restored = restore_markdown(''.join(translated), protected)
+            response = restored if restored is not None else response
 
         return response, user_lang
 
+    def _translate_segment(self, segment, user_lang, deadline=None):
+        if not segment.strip():
+            return segment
+        cached = self.cache.get(segment, 'en', user_lang)
+        if cached is not None:
+            return cached[0]
+
+        try:
+            translated = self._request(segment, 'en', user_lang, deadline)[0]
+        except Exception as e:
+            print(f"Error in translate_output: {e}")
+            return segment
+        # Each placeholder has to come back exactly once, or the code behind it would be lost or repeated.
+        if sorted(PLACEHOLDER.findall(translated)) != sorted(PLACEHOLDER.findall(segment)):
+            return segment
+        # The translator drops the whitespace around a segment; keep the original separators.
+        translated = segment[:len(segment) - len(segment.lstrip())] + translated.strip() + segment[len(segment.rstrip()):]
+        self.cache.put(segment, 'en', user_lang, (translated, user_lang))
+        return translated
+
 class Wikip:
-    def __init__(self):
+    def __init__(self, http=None):
+        self.http = http or http_client
         self.user_agent = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
-        self.wikipedia = wikipediaapi.Wikipedia('en', headers={'User-Agent': self.user_agent})
+        self.wikipedia = wikipediaapi.Wikipedia('en', headers={'User-Agent': self.user_agent}, timeout=self.http.timeout)
+        session = getattr(self.wikipedia, '_session', None)
+        if isinstance(session, requests.Session):
+            self.http.attach(session)
 
     def search(self, user_input):
         raw_query = user_input
@@ -0,0 +1,119 @@
+# bot/language_detector.py
+
+import os
+import re
+import sys
+import json
+import math
+import html
+from collections import Counter
+
+# Accented letters English borrows (café, naïve, façade, jalapeño); any other non-ASCII letter rules English out.
+LOANWORD_LETTERS = set("àáâäçèéêëíîïñóôöùúûü")
+
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'language_profiles.json')
+
+def extract_ngrams(text, sizes=(1, 2, 3)):
+    text = html.unescape(text).lower()
+    text = re.sub(r"https?://\S+|www\.\S+", ' ', text)
+    words = re.findall(r"[^\W\d_]+", text)
+    grams = []
+    for word in words:
+        padded = f" {word} "
+        for size in sizes:
+            grams.extend(padded[i:i + size] for i in range(len(padded) - size + 1))
+    return grams
+
+def build_profiles(corpora, top_k=1200, alpha=0.5):
+    """Turn {lang: training text} into per-language n-gram log-probabilities."""
+    profiles = {}
+    for lang, text in corpora.items():
+        counts = Counter(extract_ngrams(text))
+        denominator = sum(counts.values()) + alpha * (len(counts) + 1)
+        profiles[lang] = {
+            'floor': math.log(alpha / denominator),
+            'grams': {gram: round(math.log((count + alpha) / denominator), 3) for gram, count in counts.most_common(top_k) if gram.strip()},
+        }
+    # A shared floor keeps languages with smaller corpora from winning on unseen n-grams.
+    floor = round(min(profile['floor'] for profile in profiles.values()), 3)
+    for profile in profiles.values():
+        profile['floor'] = floor
+    return profiles
+
+class LanguageDetector:
+    """Offline character n-gram classifier used to skip translating text that is already English."""
+
+    def __init__(self, profile_path=None, threshold=None, min_length=None, max_grams=60, min_coverage=None, min_likelihood=None):
+        with open(profile_path or PROFILE_PATH, encoding='utf-8') as f:
+            self.profiles = json.load(f)
+        self.threshold = float(threshold if threshold is not None else os.getenv('LANG_DETECT_THRESHOLD', 0.95))
+        self.min_length = int(min_length if min_length is not None else os.getenv('LANG_DETECT_MIN_CHARS', 12))
+        self.max_grams = max_grams
+        # The softmax only compares the bundled languages, so the winner must also fit its own profile on an absolute scale.
+        self.min_coverage = float(min_coverage if min_coverage is not None else os.getenv('LANG_DETECT_MIN_COVERAGE', 0.65))
+        self.min_likelihood = float(min_likelihood if min_likelihood is not None else os.getenv('LANG_DETECT_MIN_LIKELIHOOD', -7.3))
+
+    def log_likelihoods(self, grams):
+        totals = {}
+        for lang, profile in self.profiles.items():
+            table, floor = profile['grams'], profile['floor']
+            totals[lang] = sum(table.get(gram, floor) for gram in grams)
+        return totals
+
+    def fits(self, lang, grams, total):
+        """Whether the text looks like lang at all, rather than merely less unlike it than the other profiles."""
+        coverage = sum(1 for gram in grams if gram in self.profiles[lang]['grams']) / len(grams)
+        return coverage >= self.min_coverage and total / len(grams) >= self.min_likelihood
+
+    def scores(self, text):
+        return self._scores(extract_ngrams(text))
+
+    def _scores(self, grams, totals=None):
+        if not grams:
+            return {}
+        totals = totals or self.log_likelihoods(grams)
+        # Naive Bayes is wildly overconfident on long inputs; cap the evidence it is allowed to accumulate.
+        scale = min(len(grams), self.max_grams) / len(grams)
+        best = max(totals.values())
+        weights = {lang: math.exp((total - best) * scale) for lang, total in totals.items()}
+        norm = sum(weights.values())
+        return {lang: weight / norm for lang, weight in weights.items()}
+
+    def detect(self, text):
+        letters = re.findall(r"[^\W\d_]", text)
+        if not letters:
+            return None, 0.0
+        non_latin = sum(1 for letter in letters if ord(letter) > 0x24F)
+        if non_latin / len(letters) > 0.3:
+            return None, 1.0
+        grams = extract_ngrams(text)
+        if not grams:
+            return None, 0.0
+        totals = self.log_likelihoods(grams)
+        scores = self._scores(grams, totals)
+        lang = max(scores, key=scores.get)
+        if not self.fits(lang, grams, totals[lang]):
+            return None, scores[lang]
+        return lang, scores[lang]
+
+    def is_english(self, text):
+        if not isinstance(text, str) or len(text.strip()) < self.min_length:
+            return False
+        if any(ord(letter) > 0x7F and letter.lower() not in LOANWORD_LETTERS for letter in re.findall(r"[^\W\d_]", text)):
+            return False
+        lang, confidence = self.detect(text)
+        return lang == 'en' and confidence >= self.threshold
+
+if __name__ == "__main__":
+    # python language_detector.py build <corpus_dir> -- one <lang>.txt file of sample text per language
+    if len(sys.argv) != 3 or sys.argv[1] != 'build':
+        print("usage: python language_detector.py build <corpus_dir>")
+        sys.exit(1)
+    corpora = {}
+    for name in sorted(os.listdir(sys.argv[2])):
+        if name.endswith('.txt'):
+            with open(os.path.join(sys.argv[2], name), encoding='utf-8') as f:
+                corpora[name[:-4]] = f.read()
+    with open(PROFILE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(build_profiles(corpora), f, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    print(f"Wrote profiles for {', '.join(corpora)} to {PROFILE_PATH}")
@@ -0,0 +1,204 @@
+# bot/llm_pool.py
+
+import os
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+import google.generativeai as palm
+import google.ai.generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+
+QUOTA_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+
+class NoBackendAvailable(Exception):
+    pass
+
+class Backend(ABC):
+    def __init__(self, name, weight=1):
+        self.name = name
+        self.weight = max(int(weight), 1)
+        self.outstanding = 0
+        self.current_weight = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.ejections = 0
+
+    @abstractmethod
+    def chat(self, params, messages):
+        pass
+
+    @abstractmethod
+    def generate_text(self, params, prompt):
+        pass
+
+class PalmBackend(Backend):
+    """One PaLM API key with its own discuss and text clients."""
+
+    def __init__(self, api_key, weight=1):
+        super().__init__(f"palm-{(api_key or 'default')[-4:]}", weight)
+        self.api_key = api_key
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, client_class):
+        # Clients are created on first use so a missing key only fails the request, not the import.
+        with self._lock:
+            if client_class not in self._clients:
+                self._clients[client_class] = client_class(client_options={'api_key': self.api_key})
+            return self._clients[client_class]
+
+    def chat(self, params, messages):
+        response = palm.chat(
+            **params,
+            context=None,
+            examples=None,
+            messages=messages,
+            client=self._client(glm.DiscussServiceClient),
+        )
+        return response.last
+
+    def generate_text(self, params, prompt):
+        response = palm.generate_text(
+            **params,
+            prompt=prompt,
+            client=self._client(glm.TextServiceClient),
+        )
+        return response.result
+
+class FakeBackend(Backend):
+    """Offline backend that echoes the prompt after a delay and runs out of quota like the real API."""
+
+    def __init__(self, name='fake', weight=1, latency=0.05, quota=None, window=60):
+        super().__init__(name, weight)
+        self.latency = latency
+        self.quota = quota
+        self.window = window
+        self.window_start = time.monotonic()
+        self.window_calls = 0
+        self._lock = threading.Lock()
+
+    def _spend(self):
+        if self.quota is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.window:
+                self.window_start = now
+                self.window_calls = 0
+            self.window_calls += 1
+            if self.window_calls > self.quota:
+                raise google_exceptions.ResourceExhausted(f"{self.name}: quota of {self.quota} requests exceeded")
+
+    def chat(self, params, messages):
+        self._spend()
+        time.sleep(self.latency)
+        return f"[{self.name}] {messages[-1]}"
+
+    def generate_text(self, params, prompt):
+        self._spend()
+        time.sleep(self.latency)
+        return f"[{self.name}] {prompt}"
+
+class BackendPool:
+    """Spread LLM calls over several backends and take one out of rotation while its quota recovers."""
+
+    STRATEGIES = ('least_outstanding', 'weighted_round_robin')
+
+    def __init__(self, backends, strategy=None, cooldown=None):
+        if not backends:
+            raise ValueError("BackendPool needs at least one backend")
+        self.backends = list(backends)
+        self.strategy = strategy or os.getenv('LLM_BALANCER', 'least_outstanding')
+        if self.strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown LLM_BALANCER {self.strategy!r}, expected one of {', '.join(self.STRATEGIES)}")
+        self.cooldown = float(cooldown if cooldown is not None else os.getenv('LLM_EJECT_SECONDS', 60))
+        self._lock = threading.Lock()
+
+    def _acquire(self, tried):
+        with self._lock:
+            now = time.monotonic()
+            candidates = [backend for backend in self.backends if backend not in tried and backend.ejected_until <= now]
+            if not candidates:
+                return None
+            if self.strategy == 'weighted_round_robin':
+                # Smooth weighted round-robin: heavier backends are picked more often without being picked in bursts.
+                total = sum(backend.weight for backend in candidates)
+                for backend in candidates:
+                    backend.current_weight += backend.weight
+                chosen = max(candidates, key=lambda backend: backend.current_weight)
+                chosen.current_weight -= total
+            else:
+                chosen = min(candidates, key=lambda backend: ((backend.outstanding + 1) / backend.weight, backend.requests / backend.weight))
+            chosen.outstanding += 1
+            chosen.requests += 1
+            return chosen
+
+    def _release(self, backend):
+        with self._lock:
+            backend.outstanding -= 1
+
+    def _eject(self, backend, error):
+        with self._lock:
+            backend.ejected_until = time.monotonic() + self.cooldown
+            backend.ejections += 1
+        logging.warning(f"LLM backend {backend.name} is out of quota, resting it for {self.cooldown:g}s: {error}")
+
+    def call(self, method, *args):
+        tried = set()
+        last_error = None
+        while True:
+            backend = self._acquire(tried)
+            if backend is None:
+                break
+            tried.add(backend)
+            try:
+                return getattr(backend, method)(*args)
+            except QUOTA_ERRORS as e:
+                last_error = e
+                self._eject(backend, e)
+            finally:
+                self._release(backend)
+        if last_error is not None:
+            raise last_error
+        raise NoBackendAvailable("Every LLM backend is resting after a quota error")
+
+    def chat(self, params, messages):
+        return self.call('chat', params, messages)
+
+    def generate_text(self, params, prompt):
+        return self.call('generate_text', params, prompt)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            backend.name: {
+                'weight': backend.weight,
+                'requests': backend.requests,
+                'outstanding': backend.outstanding,
+                'ejections': backend.ejections,
+                'available': backend.ejected_until <= now,
+            }
+            for backend in self.backends
+        }
+
+def parse_weighted(value):
+    """Split "a,b:3" into [('a', 1), ('b', 3)]."""
+    entries = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, weight = item.rpartition(':')
+        if not name or not weight.isdigit():
+            name, weight = item, '1'
+        entries.append((name, int(weight)))
+    return entries
+
+def create_backends():
+    keys = parse_weighted(os.getenv('PALM_API_KEYS')) or [(os.getenv('PALM_API_KEY'), 1)]
+    backends = [PalmBackend(key, weight) for key, weight in keys if key]
+    latency = float(os.getenv('LLM_FAKE_LATENCY_MS', 50)) / 1000
+    backends.extend(FakeBackend(f"fake-{i}", latency=latency) for i in range(int(os.getenv('LLM_FAKE_BACKENDS', 0))))
+    # Without any configured key keep the old behaviour: the request itself reports the missing key.
+    return backends or [PalmBackend(None)]
@@ -8,14 +8,16 @@ import time
 import html
 import re
 
-from datetime import datetime
 from dotenv import load_dotenv
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackQueryHandler, ConversationHandler
 from telegram import ChatAction, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
 from telegram.error import NetworkError
 from global_helper import helper_code, translate, image_gen, audio, wikip
 from palmai_helper import palm_instance
-from datamanager import DatabaseManager
+from datamanager import DataIdGenerator, create_storage
+from scheduler import RateLimited, scheduler, slow_down_message
+from conversation import conversation_memory
+from cache import LRUCache
 
 class BotHandler:
     connection_alive = True 
@@ -24,15 +26,30 @@ class BotHandler:
         load_dotenv('.env')
         logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
         self.bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
-        self.updater = Updater(self.bot_token, use_context=True)
+        self.scheduler = scheduler
+        # Handlers that call the LLM run on the dispatcher's worker pool and a waiting request holds its worker,
+        # so the pool has to fit every running and queued request or "the wait queue is full" could never be reached.
+        llm_workers = self.scheduler.max_concurrent + self.scheduler.max_queued
+        workers = int(os.getenv('BOT_WORKERS') or llm_workers + 4)
+        if workers < llm_workers:
+            raise ValueError(f"BOT_WORKERS must be at least LLM_MAX_CONCURRENT + LLM_QUEUE_SIZE ({llm_workers})")
+        self.updater = Updater(self.bot_token, use_context=True, workers=workers)
         self.dispatcher = self.updater.dispatcher
         self._add_CallbackQueryHandler()
         self.MAX_MESSAGE_LENGTH = 3000 # 4096 max
         self.palm_instance = palm_instance
-        self.db_manager = DatabaseManager()
+        self.IMAGE_REQUEST_COST = 3 # an image spends as much of a user's rate limit as three messages
+        if self.IMAGE_REQUEST_COST > self.scheduler.burst:
+            raise ValueError(f"USER_RATE_BURST must be at least {self.IMAGE_REQUEST_COST}, the cost of an image request")
+        self.storage = create_storage()
+        self.id_generator = DataIdGenerator()
         self.helper = helper_code
         self.translate = translate
-        self.user_last_responses = {}
+        self.conversations = conversation_memory
+        self.user_last_responses = LRUCache(
+            max_entries=os.getenv('LAST_RESPONSE_USERS', 10000),
+            max_bytes=os.getenv('LAST_RESPONSE_BYTES', 16 * 1024 * 1024),
+        )
         self.audio = audio
         
         self.wikip =wikip
@@ -52,7 +69,7 @@ class BotHandler:
             states={
                 self.WAITING_FOR_PROMPT: [MessageHandler(Filters.text & ~Filters.command, self.handle_image_prompt)],
                 self.WAITING_FOR_SIZE: [MessageHandler(Filters.text & ~Filters.command, self.handle_image_size)],
-                self.WAITING_FOR_STYLE: [MessageHandler(Filters.text & ~Filters.command, self.handle_image_style)],
+                self.WAITING_FOR_STYLE: [MessageHandler(Filters.text & ~Filters.command, self.handle_image_style, run_async=True)],
             },
             fallbacks=[],
         )
@@ -61,20 +78,20 @@ class BotHandler:
         self.dispatcher.add_handler(CommandHandler("help", self.help_command))
         self.dispatcher.add_handler(CommandHandler("start", self.start))
         self.dispatcher.add_handler(CommandHandler("reset", self.reset))
-        self.dispatcher.add_handler(CommandHandler("detailed", self.detailed))
-        self.dispatcher.add_handler(CommandHandler("simple", self.simple))
-        self.dispatcher.add_handler(CommandHandler("paraphrase", self.paraphrase))
-        self.dispatcher.add_handler(CommandHandler("summarize", self.summarize))
-        self.dispatcher.add_handler(CommandHandler("elaborate", self.elaborate))
-        self.dispatcher.add_handler(CommandHandler("generalize", self.generalize))
+        self.dispatcher.add_handler(CommandHandler("detailed", self.detailed, run_async=True))
+        self.dispatcher.add_handler(CommandHandler("simple", self.simple, run_async=True))
+        self.dispatcher.add_handler(CommandHandler("paraphrase", self.paraphrase, run_async=True))
+        self.dispatcher.add_handler(CommandHandler("summarize", self.summarize, run_async=True))
+        self.dispatcher.add_handler(CommandHandler("elaborate", self.elaborate, run_async=True))
+        self.dispatcher.add_handler(CommandHandler("generalize", self.generalize, run_async=True))
         self.dispatcher.add_handler(self.conv_handler)
         self.dispatcher.add_handler(self.wiki_conv_handler)
 
     def _add_CallbackQueryHandler(self):
-        self.dispatcher.add_handler(CallbackQueryHandler(self.button_click))
+        self.dispatcher.add_handler(CallbackQueryHandler(self.button_click, run_async=True))
 
     def _add_message_handler(self):
-        self.dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, self.process_input))
+        self.dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, self.process_input, run_async=True))
 
     def _add_error_handler(self):
         self.dispatcher.add_error_handler(self.error_handler)
@@ -108,12 +125,18 @@ class BotHandler:
             logging.info(f"got {update.message.from_user.first_name} as user with id {user_id}, input: {user_input}")
             translated_input = self.translate.translate_input(user_input)
             user_input = translated_input[0]
-            response = self.palm_instance.generate_chat(user_input)
-            if response is not None:
-                response = re.sub(r"\bI am a large language model\b", "my name is Sakura", response, flags=re.IGNORECASE)
-                message = self.translate.translate_output(response, f"{translated_input[1]}")
+            try:
+                response = self.palm_instance.generate_chat(user_input, history=self.conversations.get(user_id), slot=self.scheduler.slot(user_id))
+            except RateLimited as e:
+                logging.info(f"rate limited user {user_id}: {e}")
+                message = self.translate.translate_output(slow_down_message(e), f"{translated_input[1]}")
             else:
-                message = [f"I'm sorry, but an unexpected problem has occurred. If you wish, you can try again later."]
+                if response is not None:
+                    self.conversations.append(user_id, user_input, response)
+                    response = re.sub(r"\bI am a large language model\b", "my name is Sakura", response, flags=re.IGNORECASE)
+                    message = self.translate.translate_output(response, f"{translated_input[1]}")
+                else:
+                    message = [f"I'm sorry, but an unexpected problem has occurred. If you wish, you can try again later."]
         else:
             message = [f"Apologies, you lack the necessary authorization to utilize my services."]
         self.send_message(update, context, message)
@@ -131,7 +154,7 @@ class BotHandler:
         lang = message[1]
         data_id = self.get_data_id()
         logging.info("Storing user data")
-        self.db_manager.store_user_data(user_id, data_id, response, lang)
+        self.storage.store_user_data(user_id, data_id, response, lang)
         logging.info(f"Sending response: {message}")
         try:
             if response is not None:
@@ -159,8 +182,8 @@ class BotHandler:
             if len(callback_data_parts) == 2:
                 data_id = int(callback_data_parts[1])
                 logging.info(f"User {user_id} clicked the button for data_id {data_id}")
-                response_text = self.db_manager.retrieve_user_data_by_data_id(user_id, data_id)
-                self.user_last_responses[user_id] = response_text
+                response_text = self.storage.retrieve_user_data_by_data_id(user_id, data_id)
+                self.user_last_responses.put(user_id, response_text)
                 if callback_data_parts[0] == 'tts':
                     self.handle_tts(update, context, response_text)
                 elif callback_data_parts[0] in ['summarize', 'paraphrase', 'elaborate']:
@@ -175,9 +198,7 @@ class BotHandler:
             (update.message.from_user.id if update.message and update.message.from_user else None)
 
     def get_data_id(self):
-        current_time = datetime.now()
-        formatted_time = current_time.strftime("%d%m%y%H%M%S")
-        return int(formatted_time)
+        return self.id_generator.next_id()
 
     def get_inline_keyboard(self, data_id, index, total_chunks):
         if index == total_chunks - 1:
@@ -200,10 +221,9 @@ class BotHandler:
         if response_text:
             logging.info(f"asking for TTS")
             self.send_chat_action(update, context, ChatAction.RECORD_AUDIO)
-            self.audio.tts(response_text)
-            self.send_chat_action(update, context, ChatAction.UPLOAD_AUDIO)
-            context.bot.send_voice(chat_id=update.callback_query.message.chat_id, voice=open('voice.mp3', 'rb'))
-            os.remove('voice.mp3')
+            for key, voice in self.audio.tts_parts(response_text):
+                self.send_chat_action(update, context, ChatAction.UPLOAD_AUDIO)
+                self.send_voice(context, update.callback_query.message.chat_id, key, voice, response_text)
             logging.info("TTS done")
         else:
             message = ("Could not find response for data_id {data_id}", 'en')
@@ -211,6 +231,24 @@ class BotHandler:
             time.sleep(1)
             self.send_message(update, context, message)
 
+    def send_voice(self, context, chat_id, key, voice, response_text):
+        if isinstance(voice, str):
+            try:
+                return context.bot.send_voice(chat_id=chat_id, voice=voice)
+            except telegram.error.BadRequest:
+                logging.info("Cached voice file_id was rejected, uploading the audio again")
+                self.audio.cache.forget_file_id(key)
+                voice = self.audio.cache.get(key)
+            if voice is None:
+                # The audio behind the stale file_id has been evicted too; synthesize this part again.
+                voice = next((part for part_key, part in self.audio.tts_parts(response_text) if part_key == key), None)
+                if voice is None:
+                    key, voice = self.audio.tts(response_text)
+        sent = context.bot.send_voice(chat_id=chat_id, voice=voice, filename=self.audio.filename(voice))
+        if key is not None and sent and sent.voice:
+            self.audio.cache.set_file_id(key, sent.voice.file_id)
+        return sent
+
     def handle_text_generation(self, update, context, action):
         logging.info(f"asking for {action} answer")
         user_id = self.get_user_id_from_update(update)
@@ -222,7 +260,11 @@ class BotHandler:
 
             if translated_input:
                 command = self.get_command(action)
-                response = self.palm_instance.generate_text(f"{command} + {translated_input[0]}")
+                try:
+                    response = self.palm_instance.generate_text(f"{command} + {translated_input[0]}", slot=self.scheduler.slot(user_id))
+                except RateLimited as e:
+                    logging.info(f"rate limited user {user_id}: {e}")
+                    response = slow_down_message(e)
                 message = self.translate.translate_output(response, f"{translated_input[1]}")
             else:
                 message = ("An unexpected problem has occurred. If you wish, you can try again later.", 'en')
@@ -238,7 +280,9 @@ class BotHandler:
             message = f"{user_input}"
             translated_input = self.translate.translate_input(message)
         else:
-            message = self.user_last_responses[user_id]
+            message = self.user_last_responses.get(user_id)
+            if message is None:
+                return None
             translated_input = self.translate.translate_input({message})
 
         return translated_input
@@ -303,6 +347,7 @@ class BotHandler:
         self.send_chat_action(update, context, ChatAction.TYPING)
         if self.helper.is_user(user_id):
             logging.info(f"User selected the /start command")
+            self.conversations.clear(user_id)
             message = (f"🌸 Greetings {update.message.from_user.first_name}, I'm SakuraAI, \nyour savvy companion. How may I assist you today? 💬 \nUse \"/help\" to unveil my command prowess. Let's dive into the world of possibilities together! 🚀✨")         
         else:
             message = (f"Apologies, you lack the necessary authorization to utilize my services.",'en')
@@ -330,7 +375,11 @@ class BotHandler:
                 logging.info(f"User selected the command with input: {user_input}")
                 command = f"{command_template} + {user_input}"
                 translated_input = self.translate.translate_input(user_input)
-                response = self.palm_instance.generate_chat(command)
+                try:
+                    response = self.palm_instance.generate_chat(command, slot=self.scheduler.slot(user_id))
+                except RateLimited as e:
+                    logging.info(f"rate limited user {user_id}: {e}")
+                    response = slow_down_message(e)
                 message = self.translate.translate_output(response, translated_input[1])
             else:
                 message = (f"Please pass your argument directly after the command.", 'en')
@@ -401,8 +450,14 @@ class BotHandler:
             context.user_data['state'] = self.PROCESSING
             reply_markup = ReplyKeyboardRemove()
             logging.info(f"generating image")
-            message = update.message.reply_text("Processing...", reply_markup=reply_markup)
-            generated_image_path = self.image_gen.generate_image(prompt, style, size)
+            try:
+                with self.scheduler.slot(update.message.from_user.id, cost=self.IMAGE_REQUEST_COST):
+                    message = update.message.reply_text("Processing...", reply_markup=reply_markup)
+                    generated_image_path = self.image_gen.generate_image(prompt, style, size)
+            except RateLimited as e:
+                logging.info(f"rate limited image request from {chat_id}: {e}")
+                update.message.reply_text(slow_down_message(e), reply_markup=reply_markup)
+                return ConversationHandler.END
             if generated_image_path:
                 self.send_chat_action(update, context, ChatAction.UPLOAD_PHOTO)
                 with open(generated_image_path, "rb") as f:
@@ -442,6 +497,8 @@ class BotHandler:
         logging.info("The bot is listening for messages")
         threading.Thread(target=self.connection_watchdog, daemon=True).start()
         self.updater.idle()
+        self.storage.close()
+        self.conversations.close()
 
 if __name__ == "__main__":
     bot_handler = BotHandler()
@@ -1,11 +1,58 @@
 # bot/palmai.py
 
 import os
-import google.generativeai as palm
+import json
+import logging
+import hashlib
+import threading
+from concurrent.futures import Future
+from contextlib import nullcontext
 from dotenv import load_dotenv
+from cache import LRUCache
+from llm_pool import BackendPool, create_backends
+
+try:
+    from semantic_cache import SemanticCache
+except ImportError:
+    SemanticCache = None
 
 load_dotenv('.env')
 
+class SingleFlight:
+    """Collapse concurrent calls that share a key into one upstream call whose result they all receive."""
+
+    def __init__(self):
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.upstream_calls += 1
+            else:
+                self.coalesced_calls += 1
+        if not leader:
+            return future.result()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        return {'upstream_calls': self.upstream_calls, 'coalesced_calls': self.coalesced_calls}
+
 class Palmai:
     _instance = None  
 
@@ -16,32 +63,64 @@ class Palmai:
         return cls._instance
 
     def _initialize_palm(self):
-        api_key = os.getenv('PALM_API_KEY')
-        palm.configure(api_key=api_key)
+        self.pool = BackendPool(create_backends())
+        self.cache = LRUCache(
+            max_entries=os.getenv('LLM_CACHE_ENTRIES', 1024),
+            max_bytes=os.getenv('LLM_CACHE_BYTES', 16 * 1024 * 1024),
+            ttl=os.getenv('LLM_CACHE_TTL', 3600),
+        )
+        self.single_flight = SingleFlight()
+        self.semantic_cache = None
+        if os.getenv('SEMANTIC_CACHE', 'false').lower() in ('1', 'true', 'yes'):
+            if SemanticCache is None:
+                logging.warning("SEMANTIC_CACHE is enabled but numpy is not installed; continuing without it")
+            else:
+                self.semantic_cache = SemanticCache()
 
-    def generate_chat(self, user_input):
-        messages = [user_input]
+    def generate_chat(self, user_input, use_cache=True, history=(), slot=None):
+        """Answer from the caches, or call the LLM inside slot, a scheduler slot that cache hits never take."""
+        # An answer that depends on earlier turns is not reusable for the same question asked cold.
+        cacheable = use_cache and self.semantic_cache and not history
+        if cacheable:
+            cached = self.semantic_cache.lookup(user_input)
+            if cached is not None:
+                return cached
+        messages = [text for turn in history for text in turn] + [user_input]
         defaults = self._get_default_chat_params()
-        response = palm.chat(
-            **defaults,
-            context=None,
-            examples=None,
-            messages=messages,
-        )
-        return response.last
+        with slot or nullcontext():
+            response = self.single_flight.do(self._cache_key(defaults, messages), self._chat, defaults, messages)
+        if response is not None and cacheable:
+            self.semantic_cache.add(user_input, response)
+        return response
+
+    def _chat(self, defaults, messages):
+        return self.pool.chat(defaults, messages)
 
-    def generate_text(self, user_input):
+    def generate_text(self, user_input, use_cache=True, slot=None):
         defaults = self._get_default_text_params()
-        response = palm.generate_text(
-            **defaults,
-            prompt=user_input,
-        )
-        return response.result
+        key = self._cache_key(defaults, user_input)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        with slot or nullcontext():
+            return self.single_flight.do(key, self._generate_text, key, defaults, user_input)
+
+    def _generate_text(self, key, defaults, user_input):
+        result = self.pool.generate_text(defaults, user_input)
+        if result is not None:
+            self.cache.put(key, result)
+        return result
 
     def reset(self):
         """Reset the PalmAI instance, allowing re-initialization."""
         self.__class__._instance = None
 
+    def _cache_key(self, params, prompt):
+        """Content address of a request: the model, its sampling parameters and the prompt."""
+        payload = json.dumps({'params': params, 'prompt': prompt}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
     def _get_default_chat_params(self):
         return {
             'model': 'models/chat-bison-001',  # Chat-optimized generative language model.
@@ -0,0 +1,132 @@
+# bot/scheduler.py
+
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from cache import LRUCache
+
+class RateLimited(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost=1):
+        """Spend cost tokens and return 0, or return the seconds until they are available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate else float('inf')
+
+class FairScheduler:
+    """Per-user token buckets and a global concurrency cap, with waiting users served round-robin."""
+
+    def __init__(self, max_concurrent=None, rate=None, burst=None, max_queued=None, max_queued_per_user=None, wait_timeout=None):
+        self.max_concurrent = int(max_concurrent or os.getenv('LLM_MAX_CONCURRENT', 4))
+        self.rate = float(rate if rate is not None else os.getenv('USER_RATE_PER_MINUTE', 10)) / 60
+        self.burst = float(burst or os.getenv('USER_RATE_BURST', 5))
+        self.max_queued = int(max_queued if max_queued is not None else os.getenv('LLM_QUEUE_SIZE', 32))
+        self.max_queued_per_user = int(max_queued_per_user if max_queued_per_user is not None else os.getenv('LLM_QUEUE_PER_USER', 1))
+        self.wait_timeout = float(wait_timeout or os.getenv('LLM_QUEUE_TIMEOUT', 60))
+        self.buckets = LRUCache(max_entries=os.getenv('USER_RATE_USERS', 10000))
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._queues = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, user_id):
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self.buckets.put(user_id, bucket)
+        return bucket
+
+    def _reject(self, message, retry_after=None):
+        self.rejected += 1
+        raise RateLimited(message, retry_after)
+
+    def acquire(self, user_id, cost=1):
+        if cost > self.burst:
+            raise ValueError(f"A request costing {cost:g} can never fit a bucket of {self.burst:g}; raise USER_RATE_BURST")
+        with self._lock:
+            user_queue = self._queues.get(user_id, ())
+            if len(user_queue) >= self.max_queued_per_user:
+                self._reject(f"user {user_id} already has {len(user_queue)} request(s) waiting")
+            admit = self.running < self.max_concurrent and not self._queues
+            if not admit and self.queued >= self.max_queued:
+                self._reject("the wait queue is full")
+            # Tokens are only spent once the request is sure to run or wait, so a full queue costs the user nothing.
+            wait = self._bucket(user_id).take(cost)
+            if wait:
+                self._reject(f"user {user_id} is over their rate limit", wait)
+            if admit:
+                self.running += 1
+                self.admitted += 1
+                return
+            ticket = threading.Event()
+            self._queues.setdefault(user_id, deque()).append(ticket)
+            self.queued += 1
+        if ticket.wait(self.wait_timeout):
+            return
+        with self._lock:
+            # The slot may have been handed over just as the wait timed out.
+            if ticket.is_set():
+                return
+            user_queue = self._queues[user_id]
+            user_queue.remove(ticket)
+            if not user_queue:
+                del self._queues[user_id]
+            self.queued -= 1
+            self._reject(f"user {user_id} waited {self.wait_timeout:g}s without a free slot")
+
+    def release(self):
+        with self._lock:
+            self.running -= 1
+            while self.running < self.max_concurrent and self._queues:
+                # Serve the user at the head, then send them to the back so every waiting user gets a turn.
+                user_id, user_queue = next(iter(self._queues.items()))
+                ticket = user_queue.popleft()
+                if user_queue:
+                    self._queues.move_to_end(user_id)
+                else:
+                    del self._queues[user_id]
+                self.queued -= 1
+                self.running += 1
+                self.admitted += 1
+                ticket.set()
+
+    @contextmanager
+    def slot(self, user_id, cost=1):
+        self.acquire(user_id, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'queued': self.queued,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+        }
+
+def slow_down_message(error):
+    if error.retry_after:
+        return f"You're sending requests a little too quickly. Please wait about {max(1, round(error.retry_after))} seconds and try again."
+    return "I'm handling a lot of requests right now. Please slow down and try again in a moment."
+
+scheduler = FairScheduler()
@@ -0,0 +1,135 @@
+# bot/semantic_cache.py
+
+import os
+import re
+import time
+import zlib
+import threading
+
+import numpy as np
+
+class HashingVectorizer:
+    """Map text to a fixed-size vector of signed, hashed word and word-bigram counts."""
+
+    def __init__(self, dim=256):
+        self.dim = int(dim)
+
+    def features(self, text):
+        words = re.findall(r"\w+", text.lower())
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def transform(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        features = self.features(text)
+        if not features:
+            return vector
+        hashes = np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature in features), dtype=np.uint64, count=len(features))
+        signs = np.where(hashes & (1 << 31), -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, (hashes % self.dim).astype(np.intp), signs)
+        # Sublinear term frequency, so one repeated word cannot dominate the similarity.
+        return np.sign(vector) * np.log1p(np.abs(vector))
+
+class SemanticCache:
+    """Answer cache matched on TF-IDF cosine similarity instead of exact text."""
+
+    def __init__(self, capacity=None, dim=None, threshold=None, ttl=None, rare_fraction=None):
+        self.capacity = int(capacity or os.getenv('SEMANTIC_CACHE_SIZE', 10000))
+        self.threshold = float(threshold or os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.95))
+        self.ttl = float(ttl if ttl is not None else os.getenv('SEMANTIC_CACHE_TTL', 24 * 3600))
+        # Words in at most this share of cached questions, and any number, must match exactly before an answer is reused.
+        self.rare_fraction = float(rare_fraction if rare_fraction is not None else os.getenv('SEMANTIC_CACHE_RARE_FRACTION', 0.01))
+        self.vectorizer = HashingVectorizer(dim or os.getenv('SEMANTIC_CACHE_DIM', 256))
+        # Raw term frequencies are stored and weighted with the current IDF at lookup, so a stored question
+        # is always compared on the same terms as the query however much the IDF has moved since it was added.
+        self.vectors = np.zeros((self.capacity, self.vectorizer.dim), dtype=np.float32)
+        self.squares = np.zeros((self.capacity, self.vectorizer.dim), dtype=np.float32)
+        self.created = np.zeros(self.capacity, dtype=np.float64)
+        self.last_used = np.zeros(self.capacity, dtype=np.float64)
+        self.questions = [None] * self.capacity
+        self.answers = [None] * self.capacity
+        self.doc_freq = np.zeros(self.vectorizer.dim, dtype=np.float32)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _idf(self):
+        return np.log((1.0 + self.size) / (1.0 + self.doc_freq)) + 1.0
+
+    def _top_k(self, text, k):
+        if not self.size:
+            return []
+        weights = self._idf() ** 2
+        query = self.vectorizer.transform(text)
+        query_norm = np.sqrt(query ** 2 @ weights)
+        if not query_norm:
+            return []
+        norms = np.sqrt(self.squares[:self.size] @ weights) * query_norm
+        similarities = (self.vectors[:self.size] @ (query * weights)) / np.maximum(norms, 1e-12)
+        if self.ttl:
+            similarities[self.created[:self.size] < time.time() - self.ttl] = -1.0
+        k = min(k, self.size)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [(float(similarities[slot]), int(slot)) for slot in top]
+
+    def _rare_words(self, words):
+        rare = set()
+        for word in words:
+            slot = zlib.crc32(word.encode('utf-8')) % self.vectorizer.dim
+            if any(char.isdigit() for char in word) or self.doc_freq[slot] <= self.rare_fraction * self.size:
+                rare.add(word)
+        return rare
+
+    def _rare_words_match(self, text, slot):
+        """Reject a close match that differs in a rare word, e.g. the same question about a different year or name."""
+        words = set(re.findall(r"\w+", text.lower()))
+        cached = set(re.findall(r"\w+", self.questions[slot].lower()))
+        return not self._rare_words(words ^ cached)
+
+    def search(self, text, k=1):
+        """Return up to k (similarity, answer) pairs, best first."""
+        with self._lock:
+            return [(similarity, self.answers[slot]) for similarity, slot in self._top_k(text, k)]
+
+    def lookup(self, text):
+        with self._lock:
+            for similarity, slot in self._top_k(text, 3):
+                if similarity < self.threshold:
+                    break
+                if self._rare_words_match(text, slot):
+                    self.last_used[slot] = time.time()
+                    self.hits += 1
+                    return self.answers[slot]
+            self.misses += 1
+            return None
+
+    def add(self, text, answer):
+        with self._lock:
+            if self.size < self.capacity:
+                slot = self.size
+                self.size += 1
+            else:
+                slot = int(np.argmin(self.last_used))
+                self.doc_freq -= self.vectors[slot] != 0
+                self.evictions += 1
+            vector = self.vectorizer.transform(text)
+            self.doc_freq += vector != 0
+            now = time.time()
+            self.vectors[slot] = vector
+            self.squares[slot] = vector ** 2
+            self.created[slot] = now
+            self.last_used[slot] = now
+            self.questions[slot] = text
+            self.answers[slot] = answer
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
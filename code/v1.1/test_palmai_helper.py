@@ -0,0 +1,52 @@
+# bot/test_palmai_helper.py
+
+import threading
+import time
+
+import pytest
+
+from palmai_helper import SingleFlight
+
+def test_concurrent_calls_share_one_upstream_error():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    finish = threading.Event()
+    errors = []
+
+    def upstream():
+        started.set()
+        finish.wait(5)
+        raise ValueError("quota exceeded")
+
+    def call():
+        try:
+            single_flight.do('question', upstream)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    assert started.wait(5)
+    followers = [threading.Thread(target=call) for _ in range(4)]
+    for follower in followers:
+        follower.start()
+    deadline = time.monotonic() + 5
+    while single_flight.coalesced_calls < len(followers):
+        assert time.monotonic() < deadline, "followers never joined the leader's call"
+        time.sleep(0.001)
+    finish.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert len(errors) == 5 and all(error is errors[0] for error in errors)
+    assert single_flight.stats() == {'upstream_calls': 1, 'coalesced_calls': 4}
+
+def test_failed_call_is_not_remembered():
+    single_flight = SingleFlight()
+
+    def upstream():
+        raise ValueError("quota exceeded")
+
+    with pytest.raises(ValueError):
+        single_flight.do('question', upstream)
+    assert single_flight.do('question', lambda: "answer") == "answer"
+    assert single_flight.upstream_calls == 2
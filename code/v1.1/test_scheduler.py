@@ -0,0 +1,112 @@
+# bot/test_scheduler.py
+
+import threading
+import time
+
+import pytest
+
+import scheduler as scheduler_module
+from scheduler import FairScheduler, RateLimited
+
+def make_scheduler(**kwargs):
+    settings = dict(max_concurrent=1, rate=600, burst=10, max_queued=8, max_queued_per_user=2, wait_timeout=5)
+    settings.update(kwargs)
+    return FairScheduler(**settings)
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the scheduler"
+        time.sleep(0.001)
+
+def queue_waiter(scheduler, user_id, acquired, order):
+    """Start a thread that waits for a slot, then records which user got it."""
+    queued = scheduler.queued
+
+    def wait_for_slot():
+        scheduler.acquire(user_id)
+        order.append(user_id)
+        acquired.release()
+
+    thread = threading.Thread(target=wait_for_slot, daemon=True)
+    thread.start()
+    wait_until(lambda: scheduler.queued == queued + 1)
+    return thread
+
+def test_waiting_users_are_served_round_robin():
+    scheduler = make_scheduler()
+    scheduler.acquire('holder')
+    acquired = threading.Semaphore(0)
+    order = []
+    threads = [queue_waiter(scheduler, user_id, acquired, order) for user_id in ('heavy', 'heavy', 'light')]
+    for _ in threads:
+        scheduler.release()
+        assert acquired.acquire(timeout=5)
+    assert order == ['heavy', 'light', 'heavy']
+    scheduler.release()
+    assert scheduler.stats() == {'running': 0, 'queued': 0, 'admitted': 4, 'rejected': 0}
+
+def test_full_queue_rejects_without_spending_tokens():
+    scheduler = make_scheduler(max_queued=1, burst=2)
+    scheduler.acquire('holder')
+    acquired = threading.Semaphore(0)
+    queue_waiter(scheduler, 'waiting', acquired, [])
+    with pytest.raises(RateLimited, match="queue is full") as rejected:
+        scheduler.acquire('late')
+    assert rejected.value.retry_after is None
+    assert scheduler.buckets.get('late') is None
+    scheduler.release()
+    assert acquired.acquire(timeout=5)
+    scheduler.release()
+
+def test_user_with_a_waiting_request_is_rejected():
+    scheduler = make_scheduler(max_queued_per_user=1)
+    scheduler.acquire('holder')
+    acquired = threading.Semaphore(0)
+    queue_waiter(scheduler, 'eager', acquired, [])
+    with pytest.raises(RateLimited, match="already has 1 request"):
+        scheduler.acquire('eager')
+    scheduler.release()
+    assert acquired.acquire(timeout=5)
+    scheduler.release()
+    assert scheduler.rejected == 1
+
+def test_spent_bucket_reports_when_to_retry():
+    scheduler = make_scheduler(rate=60, burst=1)
+    with scheduler.slot('user'):
+        pass
+    with pytest.raises(RateLimited) as rejected:
+        scheduler.acquire('user')
+    assert 0 < rejected.value.retry_after <= 1
+
+def test_cost_above_burst_is_refused():
+    with pytest.raises(ValueError):
+        make_scheduler(burst=2).acquire('user', cost=3)
+
+def test_wait_timeout_gives_up_the_place_in_the_queue():
+    scheduler = make_scheduler(wait_timeout=0.05)
+    scheduler.acquire('holder')
+    with pytest.raises(RateLimited, match="without a free slot"):
+        scheduler.acquire('waiting')
+    assert scheduler.queued == 0 and not scheduler._queues
+    scheduler.release()
+    assert scheduler.running == 0
+
+def test_slot_handed_over_as_the_wait_times_out_is_kept(monkeypatch):
+    class LateEvent(threading.Event):
+        def wait(self, timeout=None):
+            # The slot arrives, but the wait still reports a timeout, as when both happen at once.
+            super().wait()
+            return False
+
+    monkeypatch.setattr(scheduler_module.threading, 'Event', LateEvent)
+    scheduler = make_scheduler()
+    scheduler.acquire('holder')
+    acquired = threading.Semaphore(0)
+    order = []
+    queue_waiter(scheduler, 'waiting', acquired, order)
+    scheduler.release()
+    assert acquired.acquire(timeout=5)
+    assert order == ['waiting']
+    assert scheduler.stats() == {'running': 1, 'queued': 0, 'admitted': 2, 'rejected': 0}
+    scheduler.release()
@@ -0,0 +1,119 @@
+# bot/test_storage.py
+
+import threading
+
+import pytest
+
+import datamanager
+
+from datamanager import STORAGE_ENGINES, DataIdGenerator, ShardedDatabaseManager, StorageBackend, create_storage, reshard
+
+@pytest.fixture(params=[(engine, write_behind) for engine in sorted(STORAGE_ENGINES) for write_behind in ('false', 'true')])
+def storage(request, tmp_path, monkeypatch):
+    """Every storage engine BotHandler can be configured with, with and without write-behind, in a fresh directory."""
+    engine, write_behind = request.param
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('DB_WRITE_BEHIND', write_behind)
+    storage = create_storage(engine)
+    yield storage
+    storage.close()
+
+def test_unknown_user_has_no_data(storage):
+    assert storage.retrieve_user_data(1) is None
+    assert storage.retrieve_user_data_by_data_id(1, 1) is None
+
+def test_replies_are_kept_per_user(storage):
+    storage.store_user_data(1, 1, "first", 'en')
+    storage.store_user_data(2, 1, "other user", 'ja')
+    assert storage.retrieve_user_data_by_data_id(1, 1) == ("first", 'en')
+    assert storage.retrieve_user_data_by_data_id(2, 1) == ("other user", 'ja')
+
+def test_storing_a_data_id_again_replaces_it(storage):
+    storage.store_user_data(1, 1, "first", 'en')
+    storage.store_user_data(1, 1, "replaced", 'id')
+    assert storage.retrieve_user_data_by_data_id(1, 1) == ("replaced", 'id')
+
+def test_only_the_newest_replies_are_retained(storage):
+    storage.store_user_data(2, 1, "other user", 'ja')
+    for data_id in range(1, storage.RETENTION + 6):
+        storage.store_user_data(1, data_id, f"reply {data_id}", 'en')
+    storage.flush()
+    rows = storage.retrieve_user_data(1)
+    assert [row[0] for row in rows] == list(range(6, storage.RETENTION + 6))
+    assert rows[-1] == (storage.RETENTION + 5, f"reply {storage.RETENTION + 5}", 'en')
+    assert storage.retrieve_user_data(2) == [(1, "other user", 'ja')]
+
+def test_unknown_engine_is_rejected():
+    with pytest.raises(ValueError):
+        create_storage('nonexistent')
+
+def test_engines_must_implement_the_interface():
+    class Incomplete(StorageBackend):
+        def store_user_data(self, user_id, data_id, response, lang):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_reshard_keeps_compressed_rows_readable(tmp_path, monkeypatch):
+    dictionary = tmp_path / 'replies.dict'
+    dictionary.write_bytes(b"Sakura says hello to everyone reading this reply. " * 20)
+    monkeypatch.setenv('DB_COMPRESSION', 'true')
+    monkeypatch.setenv('DB_COMPRESSION_DICT', str(dictionary))
+    db_file = str(tmp_path / 'user_data.db')
+    replies = {user_id: f"Sakura says hello to user {user_id}. " * 10 for user_id in range(10)}
+    storage = ShardedDatabaseManager(db_file, shards=2, write_behind=False)
+    for user_id, reply in replies.items():
+        storage.store_user_data(user_id, 1, reply, 'en')
+    storage.close()
+
+    # The new layout is opened without the custom dictionary, as after DB_COMPRESSION_DICT changes.
+    monkeypatch.delenv('DB_COMPRESSION_DICT')
+    assert reshard(db_file, 2, 3) == len(replies)
+    storage = ShardedDatabaseManager(db_file, shards=3, write_behind=False)
+    try:
+        for user_id, reply in replies.items():
+            assert storage.retrieve_user_data_by_data_id(user_id, 1) == (reply, 'en')
+    finally:
+        storage.close()
+
+def test_data_ids_are_unique_and_increasing_across_threads():
+    generator = DataIdGenerator(worker_id=1)
+    batches = [[] for _ in range(8)]
+
+    def generate(batch):
+        for _ in range(5000):
+            batch.append(generator.next_id())
+
+    threads = [threading.Thread(target=generate, args=(batch,)) for batch in batches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ids = [data_id for batch in batches for data_id in batch]
+    assert len(set(ids)) == len(ids)
+    assert all(batch == sorted(batch) for batch in batches)
+
+def test_data_ids_keep_increasing_when_the_clock_steps_back(monkeypatch):
+    generator = DataIdGenerator(worker_id=1)
+    first = generator.next_id()
+    monkeypatch.setattr(datamanager.time, 'time', lambda: (DataIdGenerator.EPOCH_MS + 1000) / 1000)
+    assert generator.next_id() > first
+
+@pytest.mark.skipif(datamanager.fcntl is None, reason="worker ids are claimed with flock")
+def test_generators_claim_different_worker_ids(tmp_path):
+    generators = [DataIdGenerator(lock_dir=str(tmp_path)) for _ in range(3)]
+    assert len({generator.worker_id for generator in generators}) == 3
+
+def test_corrupt_compressed_row_reads_as_missing(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_COMPRESSION', 'true')
+    storage = datamanager.DatabaseManager(str(tmp_path / 'user_data.db'), write_behind=False)
+    try:
+        storage.store_user_data(1, 1, "Sakura says hello. " * 20, 'en')
+        stored = storage._execute_query("SELECT response FROM responses WHERE user_id=1").fetchone()[0]
+        # A valid header in front of a truncated deflate stream.
+        storage._execute_query("UPDATE responses SET response=? WHERE user_id=1", (stored[:8] + b'\xff' * 8,))
+        storage.cache.clear()
+        assert storage.retrieve_user_data_by_data_id(1, 1) is None
+    finally:
+        storage.close()
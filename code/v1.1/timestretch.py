@@ -0,0 +1,50 @@
+# bot/timestretch.py
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+def hann(length):
+    # The periodic Hann window sums to exactly one at 50% overlap, so overlap-add keeps the level unchanged.
+    return (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(length) / length)).astype(np.float32)
+
+def wsola_positions(signal, frames, frame, analysis_hop, tolerance, decimation=4):
+    """Pick where each output frame is read from: near its nominal position, where it best continues the previous one."""
+    synthesis_hop = frame // 2
+    positions = np.empty(frames, dtype=np.int64)
+    positions[0] = tolerance
+    coarse_signal = signal[::decimation]
+    for k in range(1, frames):
+        # What would follow the previous frame if the audio were not stretched at all.
+        natural = positions[k - 1] + synthesis_hop
+        start = int(round(k * analysis_hop))
+        # Coarse search on every decimation-th sample, then refine around the best match at full resolution.
+        template = coarse_signal[natural // decimation:(natural + frame) // decimation]
+        region = coarse_signal[start // decimation:(start + 2 * tolerance + frame) // decimation]
+        coarse = int(np.argmax(np.correlate(region, template, 'valid'))) * decimation
+        low = max(0, coarse - decimation)
+        high = min(2 * tolerance, coarse + decimation)
+        candidates = sliding_window_view(signal[start + low:start + high + frame], frame)
+        positions[k] = start + low + int(np.argmax(candidates @ signal[natural:natural + frame]))
+    return positions
+
+def time_stretch(samples, speed, sample_rate, frame_ms=30, tolerance_ms=8):
+    """Play mono 16-bit PCM speed times faster without changing its pitch (WSOLA)."""
+    samples = np.asarray(samples)
+    frame = int(sample_rate * frame_ms / 1000) // 2 * 2
+    synthesis_hop = frame // 2
+    tolerance = int(sample_rate * tolerance_ms / 1000)
+    if speed == 1 or len(samples) < 2 * frame:
+        return samples.copy()
+    analysis_hop = synthesis_hop * speed
+    frames = int((len(samples) - frame) / analysis_hop) + 1
+    # Padding gives every search region and natural continuation room at both ends.
+    signal = np.zeros(len(samples) + 2 * tolerance + 2 * frame, dtype=np.float32)
+    signal[tolerance:tolerance + len(samples)] = samples.astype(np.float32) / 32768
+    positions = wsola_positions(signal, frames, frame, analysis_hop, tolerance)
+    windowed = sliding_window_view(signal, frame)[positions] * hann(frame)
+    # With a hop of half a frame, each output block is the second half of one frame plus the first half of the next.
+    blocks = np.zeros((frames + 1, synthesis_hop), dtype=np.float32)
+    blocks[:-1] += windowed[:, :synthesis_hop]
+    blocks[1:] += windowed[:, synthesis_hop:]
+    output = blocks.ravel()[:int(round(len(samples) / speed))]
+    return np.clip(np.round(output * 32768), -32768, 32767).astype('<i2')